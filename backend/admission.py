@@ -0,0 +1,234 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import defaultdict, deque
+from typing import Deque, Dict, Optional
+
+from fastapi import HTTPException
+
+import metrics
+
+# Takes a slot in the cluster-wide and per-user lease sets if both have room.
+# Expired leases (crashed workers) are dropped first.
+# KEYS: global zset, user zset. ARGV: now, expires_at, token, global_limit, user_limit, ttl
+_LEASE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[4]) then return 0 end
+if redis.call('ZCARD', KEYS[2]) >= tonumber(ARGV[5]) then return 0 end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[3])
+redis.call('ZADD', KEYS[2], ARGV[2], ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+redis.call('EXPIRE', KEYS[2], ARGV[6])
+return 1
+"""
+
+# Key for background work (memory synthesis); it gets a slot only when no user turn can take it
+BACKGROUND_USER = "system:background"
+
+class _Waiter:
+    __slots__ = ("user", "future")
+
+    def __init__(self, user: str, future: asyncio.Future):
+        self.user = user
+        self.future = future
+
+class AdmissionSlot:
+    """A granted LLM slot; release() is idempotent so every exit path can call it."""
+    def __init__(self, controller: "AdmissionController", user: str, lease: Optional[str]):
+        self.controller = controller
+        self.user = user
+        self.lease = lease
+        self.released = False
+
+    async def release(self):
+        if self.released:
+            return
+        self.released = True
+        await self.controller._release(self.user, self.lease)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.release()
+
+class AdmissionController:
+    """Bounds concurrent LLM calls per process and per user, with fair queuing.
+
+    A turn runs at once if there is capacity and nobody is waiting; otherwise it
+    waits in its user's FIFO queue and queues are served round-robin, so one busy
+    user cannot starve the rest. Turns are shed instead of piling up: 429 when a
+    user already has too many turns running or queued, 503 when the queue is full
+    or a turn waited longer than `queue_timeout`. With a Redis client and a
+    `cluster_limit`, a lease in Redis is also required, capping calls across all
+    workers; leases expire so a crashed worker cannot leak capacity. Background
+    calls use BACKGROUND_USER and are only served when no user turn is eligible.
+    """
+    GLOBAL_KEY = "admission:leases"
+    USER_KEY = "admission:leases:{user}"
+
+    def __init__(self, max_concurrent: int = 32, per_user: int = 2, max_queue: int = 256, max_queued_per_user: int = 4,
+                 queue_timeout: float = 10.0, redis_client=None, cluster_limit: int = 0, lease_ttl: int = 300):
+        self.max_concurrent = max_concurrent
+        self.per_user = per_user
+        self.max_queue = max_queue
+        self.max_queued_per_user = max_queued_per_user
+        self.queue_timeout = queue_timeout
+        self.redis_client = redis_client if cluster_limit > 0 else None
+        self.cluster_limit = cluster_limit
+        self.lease_ttl = lease_ttl
+        self._lease = self.redis_client.register_script(_LEASE_SCRIPT) if self.redis_client is not None else None
+        self.active = 0
+        self.active_by_user: Dict[str, int] = defaultdict(int)
+        self.queues: Dict[str, Deque[_Waiter]] = {}
+        self.rotation: Deque[str] = deque()
+        self.queued = 0
+
+    @classmethod
+    def from_env(cls, redis_client=None) -> "AdmissionController":
+        return cls(
+            max_concurrent=int(os.getenv("LLM_MAX_CONCURRENCY", "32")),
+            per_user=int(os.getenv("LLM_MAX_PER_USER", "2")),
+            max_queue=int(os.getenv("LLM_MAX_QUEUE", "256")),
+            max_queued_per_user=int(os.getenv("LLM_MAX_QUEUED_PER_USER", "4")),
+            queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT", "10")),
+            redis_client=redis_client,
+            cluster_limit=int(os.getenv("LLM_CLUSTER_MAX_CONCURRENCY", "0")),
+            lease_ttl=int(os.getenv("LLM_LEASE_TTL", "300")),
+        )
+
+    def stats(self) -> Dict[str, int]:
+        return {"active": self.active, "queued": self.queued, "users_waiting": len(self.queues)}
+
+    def _shed(self, status: int, reason: str, detail: str, retry_after: int):
+        metrics.ADMISSIONS.labels(reason).inc()
+        raise HTTPException(status_code=status, detail=detail, headers={"Retry-After": str(retry_after)})
+
+    async def acquire(self, user: str) -> AdmissionSlot:
+        """Waits for a slot for `user`; raises HTTPException 429/503 when the turn is shed."""
+        started = time.monotonic()
+        waiting = len(self.queues.get(user, ()))
+        if self.active_by_user.get(user, 0) + waiting >= self.per_user + self.max_queued_per_user:
+            self._shed(429, "rejected_user", "Too many turns in flight", 1)
+
+        if self.active < self.max_concurrent and self.active_by_user.get(user, 0) < self.per_user and not self.queued:
+            self._grant(user)
+        else:
+            if self.queued >= self.max_queue:
+                self._shed(503, "rejected_queue_full", "Server busy, try again shortly", 2)
+            await self._wait(user, started)
+
+        try:
+            lease = await self._cluster_lease(user, started + self.queue_timeout)
+        except BaseException:
+            await self._release(user, None)
+            raise
+        wait = time.monotonic() - started
+        metrics.ADMISSION_WAIT_SECONDS.observe(wait)
+        metrics.record("queue", wait)
+        metrics.ADMISSIONS.labels("admitted").inc()
+        return AdmissionSlot(self, user, lease)
+
+    async def _wait(self, user: str, started: float):
+        waiter = _Waiter(user, asyncio.get_running_loop().create_future())
+        if user not in self.queues:
+            self.queues[user] = deque()
+            self.rotation.append(user)
+        self.queues[user].append(waiter)
+        self.queued += 1
+        # Free slots may be waiting for this user even while other users' turns are queued
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=started + self.queue_timeout - time.monotonic())
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted in the same instant the wait ended; give the slot back
+                await self._release(user, None)
+            else:
+                waiter.future.cancel()
+                self._forget(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                self._shed(503, "timeout", "Server busy, try again shortly", 2)
+            metrics.ADMISSIONS.labels("cancelled").inc()
+            raise
+
+    def _forget(self, waiter: _Waiter):
+        queue = self.queues.get(waiter.user)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self.queued -= 1
+            if not queue:
+                del self.queues[waiter.user]
+                self.rotation.remove(waiter.user)
+
+    def _grant(self, user: str):
+        self.active += 1
+        self.active_by_user[user] += 1
+
+    def _next_user(self) -> Optional[str]:
+        """Next waiting user, in round-robin order, that is under its per-user cap."""
+        background = None
+        for _ in range(len(self.rotation)):
+            user = self.rotation[0]
+            self.rotation.rotate(-1)
+            if self.active_by_user.get(user, 0) < self.per_user:
+                if user != BACKGROUND_USER:
+                    return user
+                background = user
+        return background
+
+    def _dispatch(self):
+        """Hands free slots to waiting users in round-robin order."""
+        while self.active < self.max_concurrent and self.rotation:
+            user = self._next_user()
+            if user is None:
+                break
+            queue = self.queues[user]
+            waiter = queue.popleft()
+            self.queued -= 1
+            self._grant(user)
+            waiter.future.set_result(True)
+            if not queue:
+                del self.queues[user]
+                self.rotation.remove(user)
+
+    async def _cluster_lease(self, user: str, deadline: float) -> Optional[str]:
+        if self._lease is None:
+            return None
+        token = uuid.uuid4().hex
+        user_key = self.USER_KEY.format(user=user)
+        delay = 0.02
+        while True:
+            now = time.time()
+            try:
+                granted = await self._lease(
+                    keys=[self.GLOBAL_KEY, user_key],
+                    args=[now, now + self.lease_ttl, token, self.cluster_limit, self.per_user, self.lease_ttl]
+                )
+            except Exception as e:
+                # Coordination is best effort; the per-process limits still hold
+                print(f"Warning: admission lease unavailable: {e}")
+                return None
+            if granted:
+                return token
+            if time.monotonic() + delay > deadline:
+                self._shed(503, "timeout", "Server busy, try again shortly", 2)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.25)
+
+    async def _release(self, user: str, lease: Optional[str]):
+        self.active -= 1
+        self.active_by_user[user] -= 1
+        if self.active_by_user[user] <= 0:
+            del self.active_by_user[user]
+        self._dispatch()
+        if lease is not None:
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.zrem(self.GLOBAL_KEY, lease)
+                pipe.zrem(self.USER_KEY.format(user=user), lease)
+                await pipe.execute()
+            except Exception as e:
+                print(f"Warning: could not release admission lease: {e}")
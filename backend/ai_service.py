@@ -1,21 +1,119 @@
-import google.generativeai as genai
+import asyncio
 import os
 import re
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, AsyncIterator
 from dotenv import load_dotenv
 
 load_dotenv()
-api_key = os.getenv("GOOGLE_API_KEY")
-if api_key:
-    genai.configure(api_key=api_key)
-else:
-    print("Warning: GOOGLE_API_KEY not found in environment")
+
+_genai = None
+
+def _load_genai():
+    """Imports and configures the Gemini SDK on first use; importing it costs about a second."""
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+        api_key = os.getenv("GOOGLE_API_KEY")
+        if api_key:
+            genai.configure(api_key=api_key)
+        else:
+            print("Warning: GOOGLE_API_KEY not found in environment")
+        _genai = genai
+    return _genai
+
+STATE_MARKER = "[[STATE"
+STATE_PATTERN = re.compile(r"\[\[STATE: affection_delta=([+-]\d+), new_tags=\[(.*?)\] \]\]")
+
+def _match_to_state(match) -> Dict[str, Any]:
+    delta = int(match.group(1))
+    tags = [t.strip() for t in match.group(2).split(",")] if match.group(2) else []
+    return {"delta": delta, "tags": tags}
+
+class StateStreamParser:
+    """Strips the hidden [[STATE: ...]] block from a streamed reply as chunks arrive.
+
+    Only the tail that could be the start of the marker is held back; everything
+    else is returned from feed() immediately. Visible text is kept as a list of
+    parts and joined once, so long replies cost linear time.
+    """
+    def __init__(self):
+        self.parts: List[str] = []
+        self.state: Optional[Dict[str, Any]] = None
+        self._pending = ""
+        self._block: Optional[List[str]] = None
+        self._depth = 0
+
+    def feed(self, text: str) -> str:
+        """Consumes a chunk and returns the part of it that is safe to forward."""
+        visible: List[str] = []
+        while text:
+            if self._block is not None:
+                text = self._consume_block(text)
+                continue
+            buf = self._pending + text
+            self._pending = ""
+            idx = buf.find(STATE_MARKER)
+            if idx != -1:
+                visible.append(buf[:idx])
+                self._block = []
+                self._depth = 0
+                text = buf[idx:]
+                continue
+            keep = self._partial_marker_len(buf)
+            visible.append(buf[:len(buf) - keep])
+            self._pending = buf[len(buf) - keep:]
+            text = ""
+        out = "".join(visible)
+        if out:
+            self.parts.append(out)
+        return out
+
+    def finish(self) -> str:
+        """Flushes held-back text at the end of the stream. An unterminated block is dropped."""
+        out, self._pending = self._pending, ""
+        self._block = None
+        if out:
+            self.parts.append(out)
+        return out
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts).strip()
+
+    def _consume_block(self, text: str) -> str:
+        # Track bracket depth so tags like new_tags=[a]]] cannot end the block early
+        assert self._block is not None
+        for i, ch in enumerate(text):
+            if ch == "[":
+                self._depth += 1
+            elif ch == "]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._block.append(text[:i + 1])
+                    self._close_block()
+                    return text[i + 1:]
+        self._block.append(text)
+        return ""
+
+    def _close_block(self):
+        assert self._block is not None
+        match = STATE_PATTERN.search("".join(self._block))
+        if match and self.state is None:
+            self.state = _match_to_state(match)
+        self._block = None
+
+    @staticmethod
+    def _partial_marker_len(buf: str) -> int:
+        for k in range(min(len(STATE_MARKER) - 1, len(buf)), 0, -1):
+            if buf.endswith(STATE_MARKER[:k]):
+                return k
+        return 0
 
 class AIService:
     def __init__(self):
-        self.model = genai.GenerativeModel('gemini-1.5-pro')
+        self.model = _load_genai().GenerativeModel('gemini-1.5-pro')
 
-    async def generate_response(self, system_prompt: str, chat_history: list, user_message: str, audio_data: Optional[bytes] = None, stream=True):
+    async def generate_response(self, system_prompt: str, chat_history: list, user_message: str, audio_data: Optional[bytes] = None, stream=True, audio_mime_type: str = "audio/wav"):
         # Format history for Gemini
         contents = [{"role": "user", "parts": [{"text": system_prompt}]}]
         for msg in chat_history:
@@ -24,7 +122,7 @@ class AIService:
         # Multimodal: Audio + Text
         user_parts: List[Dict[str, Any]] = []
         if audio_data:
-            user_parts.append({"inline_data": {"mime_type": "audio/wav", "data": audio_data}})
+            user_parts.append({"inline_data": {"mime_type": audio_mime_type, "data": audio_data}})
         if user_message:
             user_parts.append({"text": user_message})
         else:
@@ -32,9 +130,38 @@ class AIService:
 
         contents.append({"role": "user", "parts": user_parts})
         
-        response = self.model.generate_content(contents, stream=stream)
+        # Async API so a slow generation never blocks the event loop for other streams
+        response = await self.model.generate_content_async(contents, stream=stream)
         return response
 
+    async def stream_text(self, response) -> AsyncIterator[str]:
+        """Yields text chunks as they arrive; cancels the upstream call if the consumer stops early.
+
+        The upstream reads run in their own task, which is cancelled on an early
+        exit: grpc.aio cancels the RPC when its pending read is cancelled, so no
+        SDK internals are needed to stop generation.
+        """
+        chunks: asyncio.Queue = asyncio.Queue()
+
+        async def read():
+            try:
+                async for chunk in response:
+                    if chunk.text:
+                        chunks.put_nowait(chunk.text)
+            finally:
+                chunks.put_nowait(None)
+
+        reader = asyncio.create_task(read(), name="gemini-stream")
+        try:
+            while (text := await chunks.get()) is not None:
+                yield text
+            # Re-raises an upstream error
+            await reader
+        finally:
+            if not reader.done():
+                reader.cancel()
+                await asyncio.wait([reader])
+
     def extract_emotion(self, text: str) -> str:
         """Parses text for action descriptions to infer emotional state."""
         # Simple heuristic: text inside asterisks often contains emotional cues
@@ -71,11 +198,8 @@ class AIService:
 
     def parse_state_updates(self, text: str):
         """Extracts hidden state metadata from AI responses."""
-        pattern = r"\[\[STATE: affection_delta=([+-]\d+), new_tags=\[(.*?)\] \]\]"
-        match = re.search(pattern, text)
+        match = STATE_PATTERN.search(text)
         if match:
-            delta = int(match.group(1))
-            tags = [t.strip() for t in match.group(2).split(",")] if match.group(2) else []
-            clean_text = re.sub(pattern, "", text).strip()
-            return clean_text, {"delta": delta, "tags": tags}
+            clean_text = STATE_PATTERN.sub("", text).strip()
+            return clean_text, _match_to_state(match)
         return text, None
@@ -0,0 +1,186 @@
+import io
+import os
+import wave
+from typing import Optional
+
+import numpy as np
+from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from dotenv import load_dotenv
+
+from metrics import stage
+
+load_dotenv()
+
+MAX_UPLOAD_BYTES = int(os.getenv("VOICE_MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+MAX_SECONDS = float(os.getenv("VOICE_MAX_SECONDS", "120"))
+TARGET_RATE = int(os.getenv("VOICE_TARGET_RATE", "16000"))
+TRIM_SILENCE = os.getenv("VOICE_TRIM_SILENCE", "true").lower() == "true"
+
+_READ_FRAMES = 65536
+
+def sniff_mime_type(header: bytes) -> str:
+    """Container type from the first bytes; browsers often label webm/ogg recordings as wav."""
+    if header[:4] == b"RIFF" and header[8:12] == b"WAVE":
+        return "audio/wav"
+    if header[:4] == b"OggS":
+        return "audio/ogg"
+    if header[:4] == b"\x1a\x45\xdf\xa3":
+        return "audio/webm"
+    if header[:4] == b"fLaC":
+        return "audio/flac"
+    if header[:3] == b"ID3" or header[:2] in (b"\xff\xfb", b"\xff\xf3", b"\xff\xf2"):
+        return "audio/mpeg"
+    if header[4:8] == b"ftyp":
+        return "audio/mp4"
+    return "audio/wav"
+
+def _to_float(raw: bytes, width: int) -> np.ndarray:
+    if width == 1:
+        return (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    if width == 2:
+        return np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    if width == 3:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        value = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        value = np.where(value & 0x800000, value - 0x1000000, value)
+        return value.astype(np.float32) / 8388608.0
+    return np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648.0
+
+def read_wav_mono(fileobj) -> tuple:
+    """Decodes PCM WAV block by block, downmixing as it goes; returns (samples, rate)."""
+    with wave.open(fileobj, "rb") as w:
+        channels, width, rate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+        if rate <= 0 or channels <= 0:
+            raise HTTPException(status_code=400, detail="Invalid WAV header")
+        if w.getnframes() / rate > MAX_SECONDS:
+            raise HTTPException(status_code=413, detail=f"Audio longer than {MAX_SECONDS:.0f} seconds")
+        blocks = []
+        while True:
+            raw = w.readframes(_READ_FRAMES)
+            if not raw:
+                break
+            samples = _to_float(raw, width)
+            if channels > 1:
+                samples = samples.reshape(-1, channels).mean(axis=1)
+            blocks.append(samples)
+    return (np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.float32)), rate
+
+def resample(samples: np.ndarray, rate: int, target: int, taps: int = 63) -> np.ndarray:
+    """Windowed-sinc low-pass (when downsampling) followed by linear interpolation."""
+    if rate == target or samples.size == 0:
+        return samples
+    if target < rate:
+        cutoff = 0.5 * target / rate
+        n = np.arange(taps) - (taps - 1) / 2
+        kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+        samples = np.convolve(samples, (kernel / kernel.sum()).astype(np.float32), mode="same")
+    length = int(round(samples.size * target / rate))
+    positions = np.arange(length, dtype=np.float64) * (rate / target)
+    return np.interp(positions, np.arange(samples.size), samples).astype(np.float32)
+
+def trim_silence(samples: np.ndarray, rate: int, frame_ms: int = 20, relative_db: float = -35.0,
+                 floor_db: float = -55.0, pad_ms: int = 150) -> np.ndarray:
+    """Energy VAD: drops leading and trailing frames quieter than the threshold.
+
+    The threshold is relative to the loudest frame, but never below an absolute
+    floor, so a quiet but clean recording keeps its speech. A little padding is
+    left around the voiced region so word onsets are not clipped.
+    """
+    frame = max(1, rate * frame_ms // 1000)
+    count = samples.size // frame
+    if count == 0:
+        return samples
+    frames = samples[:count * frame].reshape(count, frame)
+    rms = np.sqrt(np.mean(frames * frames, axis=1) + 1e-12)
+    threshold = max(rms.max() * 10 ** (relative_db / 20), 10 ** (floor_db / 20))
+    voiced = np.flatnonzero(rms >= threshold)
+    if voiced.size == 0:
+        # Nothing above the floor; let the model decide rather than sending nothing
+        return samples
+    pad = rate * pad_ms // 1000
+    start = max(0, voiced[0] * frame - pad)
+    end = min(samples.size, (voiced[-1] + 1) * frame + pad)
+    return samples[start:end]
+
+def encode_wav(samples: np.ndarray, rate: int) -> bytes:
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767.0).astype("<i2")
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(pcm.tobytes())
+    return buf.getvalue()
+
+def preprocess_wav(fileobj) -> Optional[bytes]:
+    """Mono, TARGET_RATE, silence-trimmed 16-bit WAV; None if the WAV cannot be decoded here."""
+    try:
+        samples, rate = read_wav_mono(fileobj)
+    except (wave.Error, EOFError, ValueError):
+        # Compressed or float WAV variants are sent as uploaded
+        return None
+    samples = resample(samples, rate, TARGET_RATE)
+    if TRIM_SILENCE:
+        samples = trim_silence(samples, TARGET_RATE)
+    return encode_wav(samples, TARGET_RATE)
+
+class PreparedAudio:
+    def __init__(self, data: bytes, mime_type: str):
+        self.data = data
+        self.mime_type = mime_type
+
+async def prepare_upload(upload: UploadFile) -> PreparedAudio:
+    """Reads a voice upload from its spooled file, compacting PCM WAV before it is sent upstream."""
+    fileobj = upload.file
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(0)
+    if size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Audio upload too large")
+    if size == 0:
+        raise HTTPException(status_code=400, detail="Empty audio upload")
+
+    mime_type = sniff_mime_type(fileobj.read(12))
+    fileobj.seek(0)
+    if mime_type == "audio/wav":
+        with stage("audio_preprocess"):
+            data = await run_in_threadpool(preprocess_wav, fileobj)
+        if data is not None:
+            return PreparedAudio(data, mime_type)
+        fileobj.seek(0)
+    return PreparedAudio(await run_in_threadpool(fileobj.read), mime_type)
+
+class UploadLimitMiddleware:
+    """Rejects request bodies over `max_bytes` on the given path prefix before they are buffered.
+
+    A declared Content-Length is checked up front; chunked bodies are counted as
+    they arrive and fail with 413 as soon as they pass the limit.
+    """
+    def __init__(self, app, path_prefix: str, max_bytes: int):
+        self.app = app
+        self.path_prefix = path_prefix
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+        for key, value in scope.get("headers", []):
+            if key == b"content-length" and value.isdigit() and int(value) > self.max_bytes:
+                await send({"type": "http.response.start", "status": 413, "headers": [(b"content-type", b"application/json")]})
+                await send({"type": "http.response.body", "body": b'{"detail":"Audio upload too large"}'})
+                return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail="Audio upload too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,312 @@
+"""Load test for /chat and /chat/voice against local stand-ins.
+
+Gemini is replaced by FakeGenerativeModel (configurable first-token latency and
+token rate), ElevenLabs by the fake TTS server, Redis by fakeredis unless
+--redis-url is given, Postgres by a temporary SQLite file and Chroma runs
+in-process with hashed embeddings. The app is served by uvicorn on a local port
+and driven over real HTTP, so streaming timings are what a client would see.
+
+Run from backend/: python -m benchmarks.chat_load --concurrency 8 --requests 200 --output results.json
+Compare with a saved run: ... --baseline results.json --tolerance 0.2 (exit code 1 on regression)
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import wave
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+import uvicorn
+
+# Per-stage server timings collected by wrapping main's pipeline functions
+STAGES: Dict[str, List[float]] = defaultdict(list)
+STAGE_FUNCTIONS = ["gather_turn_context", "load_turn_state", "get_recent_history", "build_prompt", "record_user_turn", "save_assistant_turn"]
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "mean": round(statistics.fmean(ordered), 2),
+        "p50": round(pick(0.50), 2),
+        "p95": round(pick(0.95), 2),
+        "p99": round(pick(0.99), 2),
+        "max": round(ordered[-1], 2),
+    }
+
+def timed(name: str, fn: Callable) -> Callable:
+    if asyncio.iscoroutinefunction(fn):
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                STAGES[name].append((time.perf_counter() - start) * 1000)
+    else:
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                STAGES[name].append((time.perf_counter() - start) * 1000)
+    return wrapper
+
+def silent_wav(seconds: float = 1.0, rate: int = 16000) -> bytes:
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b"\x00\x00" * int(seconds * rate))
+    return buf.getvalue()
+
+class AppServer:
+    """Serves the backend app with uvicorn on a background thread."""
+    def __init__(self, app, port: int):
+        self.port = port
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.run, daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + 30
+        while not self.server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("app server did not start")
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+        if self._thread:
+            self._thread.join(10)
+
+async def create_sessions(client: httpx.AsyncClient, count: int) -> List[int]:
+    """One user per session, so the per-user admission cap does not shed the benchmark itself."""
+    users = [(await client.post("/auth/register", json={"username": f"bench{i}", "email": f"bench{i}@example.com", "hashed_password": "x"})).json()
+             for i in range(count)]
+    character = (await client.post("/characters/", json={
+        "name": "Bench", "description": "A patient listener.", "traits": ["calm"],
+        "system_prompt": "Stay in character.", "owner_id": users[0]["user_id"]
+    })).json()
+    sessions = []
+    for user in users:
+        session = (await client.post("/sessions/", json={"user_id": user["user_id"], "character_id": character["id"]})).json()
+        sessions.append(session["id"])
+    return sessions
+
+async def chat_turn(client: httpx.AsyncClient, session_id: int, i: int) -> Dict[str, Any]:
+    """One SSE chat turn; times headers, first token and the end of the stream."""
+    start = time.perf_counter()
+    first = last = None
+    tokens = 0
+    async with client.stream("POST", f"/chat/{session_id}", params={"user_message": f"How was the garden today? ({i})"},
+                             headers={"accept": "text/event-stream"}) as response:
+        headers_at = time.perf_counter()
+        if response.status_code != 200:
+            await response.aread()
+            return {"error": response.status_code}
+        async for line in response.aiter_lines():
+            if line == "event: token":
+                now = time.perf_counter()
+                first = first or now
+                last = now
+                tokens += 1
+    end = time.perf_counter()
+    if first is None:
+        return {"error": "no tokens"}
+    stream_seconds = last - first
+    return {
+        "headers_ms": (headers_at - start) * 1000,
+        "ttft_ms": (first - start) * 1000,
+        "stream_ms": stream_seconds * 1000,
+        "latency_ms": (end - start) * 1000,
+        "tokens": tokens,
+        "tokens_per_s": (tokens - 1) / stream_seconds if stream_seconds > 0 else None,
+    }
+
+async def voice_turn(client: httpx.AsyncClient, session_id: int, i: int, audio: bytes, stream: bool) -> Dict[str, Any]:
+    """One voice turn; times headers, first audio byte and the full body."""
+    start = time.perf_counter()
+    first = None
+    size = 0
+    async with client.stream("POST", f"/chat/voice/{session_id}", params={"stream": str(stream).lower()},
+                             files={"audio_file": ("turn.wav", audio, "audio/wav")}) as response:
+        headers_at = time.perf_counter()
+        if response.status_code != 200:
+            await response.aread()
+            return {"error": response.status_code}
+        async for chunk in response.aiter_bytes():
+            first = first or time.perf_counter()
+            size += len(chunk)
+    end = time.perf_counter()
+    return {
+        "headers_ms": (headers_at - start) * 1000,
+        "ttfa_ms": ((first or end) - start) * 1000,
+        "latency_ms": (end - start) * 1000,
+        "audio_bytes": size,
+    }
+
+async def drive(name: str, turn: Callable, sessions: List[int], total: int, concurrency: int) -> Dict[str, Any]:
+    """Runs `total` turns with `concurrency` workers, each on its own session."""
+    results: List[Dict[str, Any]] = []
+    counter = iter(range(total))
+
+    async def worker(session_id: int):
+        for i in counter:
+            try:
+                results.append(await turn(session_id, i))
+            except Exception as e:
+                results.append({"error": type(e).__name__})
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(sessions[w % len(sessions)]) for w in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    ok = [r for r in results if "error" not in r]
+    summary: Dict[str, Any] = {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+    }
+    for key in ("headers_ms", "ttft_ms", "ttfa_ms", "stream_ms", "latency_ms", "tokens_per_s"):
+        values = [r[key] for r in ok if r.get(key) is not None]
+        if values:
+            summary[key] = percentiles(values)
+    print(f"{name}: {summary['requests']} requests, {summary['errors']} errors, {summary['throughput_rps']} req/s", file=sys.stderr)
+    return summary
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Scenario metrics whose p95 grew by more than `tolerance` over the baseline."""
+    regressions = []
+    for scenario, metrics in results["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(scenario, {})
+        for key, value in metrics.items():
+            if not isinstance(value, dict) or key == "tokens_per_s" or "p95" not in old.get(key, {}):
+                continue
+            before, after = old[key]["p95"], value["p95"]
+            if before > 0 and after > before * (1 + tolerance):
+                regressions.append(f"{scenario}.{key}.p95: {before} -> {after}")
+        old_rate = old.get("tokens_per_s", {}).get("p50")
+        new_rate = metrics.get("tokens_per_s", {}).get("p50")
+        if old_rate and new_rate and new_rate < old_rate * (1 - tolerance):
+            regressions.append(f"{scenario}.tokens_per_s.p50: {old_rate} -> {new_rate}")
+    return regressions
+
+def configure_environment(args, workdir: str):
+    from benchmarks import fakes
+    from benchmarks.fake_tts import FakeTTSServer
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["CHROMA_PATH"] = os.path.join(workdir, "chroma")
+    os.environ["MEMORY_SYNTHESIS_ENABLED"] = "false"
+    if args.redis_url:
+        os.environ["REDIS_URL"] = args.redis_url
+    else:
+        os.environ["REDIS_URL"] = "redis://fakeredis/0"
+        fakes.use_fakeredis()
+    fakes.use_hash_embeddings()
+
+    tts = FakeTTSServer(args.tts_port, base_latency=args.tts_latency, per_char_latency=args.tts_per_char).start()
+    os.environ["ELEVENLABS_API_KEY"] = "bench"
+    os.environ["ELEVENLABS_BASE_URL"] = tts.base_url
+    return tts
+
+async def run(args) -> Dict[str, Any]:
+    base_url = f"http://127.0.0.1:{args.port}"
+    limits = httpx.Limits(max_connections=args.concurrency + 4, max_keepalive_connections=args.concurrency + 4)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        sessions = await create_sessions(client, args.concurrency)
+        audio = silent_wav()
+        scenarios: Dict[str, Any] = {}
+        if args.warmup:
+            await drive("warmup", lambda s, i: chat_turn(client, s, i), sessions, args.warmup, args.concurrency)
+            STAGES.clear()
+        if "chat" in args.scenarios:
+            scenarios["chat"] = await drive("chat", lambda s, i: chat_turn(client, s, i), sessions, args.requests, args.concurrency)
+        if "voice" in args.scenarios:
+            scenarios["voice"] = await drive("voice", lambda s, i: voice_turn(client, s, i, audio, False), sessions, args.requests, args.concurrency)
+        if "voice_stream" in args.scenarios:
+            scenarios["voice_stream"] = await drive("voice_stream", lambda s, i: voice_turn(client, s, i, audio, True), sessions, args.requests, args.concurrency)
+    return scenarios
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default="chat,voice,voice_stream", help="comma-separated: chat, voice, voice_stream")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="turns per scenario")
+    parser.add_argument("--warmup", type=int, default=8, help="untimed chat turns before measuring")
+    parser.add_argument("--first-token-latency", type=float, default=0.3, help="fake model seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="fake model token rate")
+    parser.add_argument("--reply-tokens", type=int, default=60)
+    parser.add_argument("--tts-latency", type=float, default=0.15)
+    parser.add_argument("--tts-per-char", type=float, default=0.002)
+    parser.add_argument("--redis-url", help="use a real Redis instead of fakeredis")
+    parser.add_argument("--port", type=int, default=8791)
+    parser.add_argument("--tts-port", type=int, default=8792)
+    parser.add_argument("--output", help="write the JSON results here as well as to stdout")
+    parser.add_argument("--baseline", help="earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression before failing")
+    args = parser.parse_args()
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+
+    workdir = tempfile.mkdtemp(prefix="chat-bench-")
+    tts = configure_environment(args, workdir)
+    server = None
+    try:
+        import main as app_module
+        from benchmarks.fakes import FakeAIService, FakeGenerativeModel
+        model = FakeGenerativeModel(args.first_token_latency, args.tokens_per_second, args.reply_tokens)
+        app_module.ai_service = FakeAIService(model)
+        # Build the remaining services now so their methods can be wrapped before serving
+        app_module.init_services()
+        for name in STAGE_FUNCTIONS:
+            setattr(app_module, name, timed(name, getattr(app_module, name)))
+        app_module.memory_service.get_context_async = timed("memory_context", app_module.memory_service.get_context_async)
+        app_module.memory_service.partitions.query = timed("chroma_query", app_module.memory_service.partitions.query)
+
+        server = AppServer(app_module.app, args.port).start()
+        scenarios = asyncio.run(run(args))
+        results = {
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+            "scenarios": scenarios,
+            "server_stages_ms": {name: percentiles(values) for name, values in sorted(STAGES.items())},
+            "memory_ingest": app_module.memory_service.ingest_queue.stats(),
+        }
+    finally:
+        if server:
+            server.stop()
+        tts.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
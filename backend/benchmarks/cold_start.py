@@ -0,0 +1,148 @@
+"""Cold-start benchmark: how long a fresh worker takes to bind, become ready and serve a turn.
+
+Each run starts the app in a new process with its own SQLite file and Chroma
+directory, then polls /healthz (the worker is accepting connections) and
+/readyz (services built and the embedding model warmed). It then times the
+first two chat turns. Gemini is faked and Redis is fakeredis. The embedding
+model is the real ONNX one, which is most of the warmup, unless
+--hash-embeddings is given; the model must already be in Chroma's cache or
+it is downloaded on the first run. Installing the hashed embeddings imports
+Chroma before the app, so in that mode bind times include the Chroma import.
+
+Run from backend/: python -m benchmarks.cold_start --runs 5 --output cold.json
+Compare with a saved run: ... --baseline cold.json --tolerance 0.2 (exit code 1 on regression)
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+from benchmarks.chat_load import percentiles
+
+METRICS = ("healthz_s", "ready_s", "first_turn_ms", "second_turn_ms")
+
+def serve(args):
+    """Child process: install the fakes, import the app and serve it."""
+    from benchmarks import fakes
+    fakes.use_fakeredis()
+    if args.hash_embeddings:
+        fakes.use_hash_embeddings()
+    import uvicorn
+    import main
+    main.ai_service = fakes.FakeAIService(fakes.FakeGenerativeModel(first_token_latency=0.05, tokens_per_second=500.0, reply_tokens=20))
+    uvicorn.run(main.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+def wait_for(client: httpx.Client, path: str, started: float, timeout: float, process: subprocess.Popen) -> float:
+    """Seconds from process start until `path` answers 200."""
+    deadline = started + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"app process exited with code {process.returncode}")
+        try:
+            response = client.get(path)
+        except httpx.TransportError:
+            response = None
+        if response is not None:
+            if response.status_code == 200:
+                return time.perf_counter() - started
+            error = response.json().get("error")
+            if error:
+                raise RuntimeError(f"service warmup failed: {error}")
+        time.sleep(0.01)
+    raise RuntimeError(f"{path} not ready after {timeout}s")
+
+def chat_turn(client: httpx.Client, session_id: int, text: str) -> float:
+    start = time.perf_counter()
+    response = client.post(f"/chat/{session_id}", params={"user_message": text}, headers={"accept": "text/event-stream"})
+    response.raise_for_status()
+    return (time.perf_counter() - start) * 1000
+
+def cold_start(args, run: int) -> Dict[str, Any]:
+    workdir = tempfile.mkdtemp(prefix="cold-start-")
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "CHROMA_PATH": os.path.join(workdir, "chroma"),
+        "REDIS_URL": "redis://fakeredis/0",
+        "MEMORY_SYNTHESIS_ENABLED": "false",
+    }
+    command = [sys.executable, "-m", "benchmarks.cold_start", "--serve", "--port", str(args.port)]
+    if args.hash_embeddings:
+        command.append("--hash-embeddings")
+    started = time.perf_counter()
+    process = subprocess.Popen(command, env=env)
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{args.port}", timeout=60) as client:
+            result = {"healthz_s": wait_for(client, "/healthz", started, args.timeout, process)}
+            result["ready_s"] = wait_for(client, "/readyz", started, args.timeout, process)
+            user = client.post("/auth/register", json={"username": f"cold{run}", "email": f"cold{run}@example.com", "hashed_password": "x"}).json()
+            character = client.post("/characters/", json={
+                "name": "Bench", "description": "A patient listener.", "traits": ["calm"],
+                "system_prompt": "Stay in character.", "owner_id": user["user_id"]
+            }).json()
+            session = client.post("/sessions/", json={"user_id": user["user_id"], "character_id": character["id"]}).json()
+            result["first_turn_ms"] = chat_turn(client, session["id"], "Hello, how was your day?")
+            result["second_turn_ms"] = chat_turn(client, session["id"], "Tell me more about the garden.")
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(f"run {run}: bound {result['healthz_s']:.2f}s, ready {result['ready_s']:.2f}s, "
+          f"first turn {result['first_turn_ms']:.0f}ms", file=sys.stderr)
+    return result
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Metrics whose median grew by more than `tolerance` over the baseline."""
+    regressions = []
+    for key, value in results["summary"].items():
+        before = baseline.get("summary", {}).get(key, {}).get("p50")
+        if before and value["p50"] > before * (1 + tolerance):
+            regressions.append(f"{key}.p50: {before} -> {value['p50']}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8793)
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds to wait for each probe")
+    parser.add_argument("--hash-embeddings", action="store_true", help="skip the ONNX model (measures everything but model load)")
+    parser.add_argument("--output", help="write the JSON results here as well as to stdout")
+    parser.add_argument("--baseline", help="earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression before failing")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args)
+        return
+
+    runs = [cold_start(args, run) for run in range(args.runs)]
+    results = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "serve")},
+        "runs": runs,
+        "summary": {key: percentiles([run[key] for run in runs]) for key in METRICS},
+    }
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
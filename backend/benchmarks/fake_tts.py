@@ -0,0 +1,76 @@
+"""Local stand-in for the ElevenLabs text-to-speech API.
+
+Point the backend at it with ELEVENLABS_BASE_URL=http://127.0.0.1:<port> and any
+ELEVENLABS_API_KEY. Latency is modelled as a fixed delay plus a per-character cost,
+and the body is fake MPEG audio sized proportionally to the text.
+
+Run standalone from backend/: python -m benchmarks.fake_tts --port 8765
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+
+def fake_audio(text: str, bytes_per_char: int = 80) -> bytes:
+    """An ID3 header followed by filler frames; clients only measure size and timing."""
+    return b"ID3" + b"\xff\xfb" * (bytes_per_char * max(1, len(text)) // 2)
+
+def create_app(base_latency: float = 0.15, per_char_latency: float = 0.002, bytes_per_char: int = 80) -> FastAPI:
+    app = FastAPI(title="Fake TTS")
+    app.state.requests = 0
+    # (text, started, finished) per request, on the perf_counter clock
+    app.state.log = []
+
+    @app.post("/v1/text-to-speech/{voice_id}")
+    async def text_to_speech(voice_id: str, request: Request):
+        body = await request.json()
+        text = body.get("text", "")
+        app.state.requests += 1
+        started = time.perf_counter()
+        await asyncio.sleep(base_latency + per_char_latency * len(text))
+        app.state.log.append((text, started, time.perf_counter()))
+        return Response(content=fake_audio(text, bytes_per_char), media_type="audio/mpeg")
+
+    return app
+
+class FakeTTSServer:
+    """Runs the fake TTS app with uvicorn on a background thread."""
+    def __init__(self, port: int = 8765, **app_kwargs):
+        self.port = port
+        self.app = create_app(**app_kwargs)
+        self.server = uvicorn.Server(uvicorn.Config(self.app, host="127.0.0.1", port=port, log_level="warning"))
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.run, daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self.server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("fake TTS server did not start")
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+        if self._thread:
+            self._thread.join(5)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--base-latency", type=float, default=0.15)
+    parser.add_argument("--per-char-latency", type=float, default=0.002)
+    args = parser.parse_args()
+    app = create_app(args.base_latency, args.per_char_latency)
+    uvicorn.run(app, host="127.0.0.1", port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Local stand-ins for the backend's external dependencies.
+
+Install them before `main` is imported: use_fakeredis() routes every Redis pool
+to an in-process fakeredis server (Lua scripts need `pip install "fakeredis[lua]"`),
+use_hash_embeddings() replaces Chroma's ONNX model with a deterministic hashed
+bag-of-words embedding, and FakeAIService/FakeGenerativeModel stand in for Gemini.
+SQLite and an in-process Chroma need no fakes, only a DATABASE_URL/CHROMA_PATH.
+"""
+import asyncio
+import hashlib
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from ai_service import AIService
+
+REPLY_WORDS = ("I remember that you told me about the garden behind your house and how the "
+               "morning light makes everything feel calm so tell me more about your day").split()
+
+class FakeChunk:
+    def __init__(self, text: str):
+        self.text = text
+
+class FakeResponse:
+    """Streams pre-split tokens at a fixed rate, like a Gemini streaming response.
+
+    Like grpc.aio, cancelling a pending read cancels the call and sets
+    `cancelled`; `streamed` counts the chunks handed out before the stream
+    ended or was cancelled.
+    """
+    def __init__(self, tokens: List[str], token_interval: float):
+        self.tokens = tokens
+        self.token_interval = token_interval
+        self.text = "".join(tokens)
+        self.streamed = 0
+        self.cancelled = False
+        self.finished_at: Optional[float] = None
+
+    async def __aiter__(self):
+        try:
+            for i, token in enumerate(self.tokens):
+                if i:
+                    await asyncio.sleep(self.token_interval)
+                self.streamed += 1
+                yield FakeChunk(token)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        self.finished_at = time.perf_counter()
+
+class FakeGenerativeModel:
+    """Drop-in for genai.GenerativeModel with a configurable first-token latency and token rate.
+
+    Each reply is `reply_tokens` words followed by a state block, so the real
+    stream parsing, moderation and state update paths are exercised. Pass
+    `tokens` to script the reply instead; `responses` keeps every reply handed out.
+    """
+    def __init__(self, first_token_latency: float = 0.3, tokens_per_second: float = 50.0, reply_tokens: int = 60,
+                 tokens: Optional[List[str]] = None):
+        self.first_token_latency = first_token_latency
+        self.token_interval = 1.0 / tokens_per_second if tokens_per_second > 0 else 0.0
+        self.reply_tokens = reply_tokens
+        self.tokens = tokens
+        self.calls = 0
+        self.responses: List[FakeResponse] = []
+
+    def reply(self) -> List[str]:
+        if self.tokens is not None:
+            return list(self.tokens)
+        words = [REPLY_WORDS[i % len(REPLY_WORDS)] for i in range(self.reply_tokens)]
+        tokens = [w + (". " if i % 12 == 11 else " ") for i, w in enumerate(words)]
+        return tokens + ["[[STATE: affection_delta=+1, new_tags=[garden] ]]"]
+
+    async def generate_content_async(self, contents, stream: bool = False, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.first_token_latency)
+        tokens = self.reply()
+        if not stream:
+            # A non-streamed call returns once the whole reply is generated
+            await asyncio.sleep(self.token_interval * (len(tokens) - 1))
+        response = FakeResponse(tokens, self.token_interval)
+        self.responses.append(response)
+        return response
+
+class FakeAIService(AIService):
+    """The real AIService (prompt formatting, stream handling) backed by a fake model."""
+    def __init__(self, model: Optional[FakeGenerativeModel] = None):
+        self.model = model or FakeGenerativeModel()
+
+class HashEmbeddingFunction:
+    """Deterministic hashed bag-of-words vectors; no model download or inference."""
+    def __init__(self, dimensions: int = 64):
+        self.dimensions = dimensions
+
+    def __call__(self, input):
+        out = []
+        for text in input:
+            vector = np.zeros(self.dimensions, dtype=np.float32)
+            for word in text.lower().split():
+                vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % self.dimensions] += 1.0
+            norm = np.linalg.norm(vector)
+            out.append(vector / norm if norm else vector)
+        return out
+
+    @staticmethod
+    def name() -> str:
+        return "default"
+
+    def get_config(self):
+        return {}
+
+    @staticmethod
+    def build_from_config(config):
+        return HashEmbeddingFunction()
+
+    def is_legacy(self) -> bool:
+        return False
+
+def use_hash_embeddings():
+    from chromadb.utils import embedding_functions
+    embedding_functions.DefaultEmbeddingFunction = HashEmbeddingFunction
+
+def use_fakeredis():
+    """Points redis.Redis.from_url and the connection pool factories at one in-process server."""
+    import fakeredis
+    import redis
+    import redis.asyncio
+
+    server = fakeredis.FakeServer()
+
+    def pool_kwargs(kwargs):
+        return {k: v for k, v in kwargs.items() if k != "health_check_interval"}
+
+    redis.Redis.from_url = classmethod(lambda cls, url, **kw: fakeredis.FakeRedis(server=server, **kw))
+    redis.ConnectionPool.from_url = classmethod(lambda cls, url, **kw: redis.ConnectionPool(
+        connection_class=fakeredis.FakeConnection, server=server, **pool_kwargs(kw)))
+    async_connection = fakeredis.FakeAsyncRedis(server=server).connection_pool.connection_class
+    redis.asyncio.ConnectionPool.from_url = classmethod(lambda cls, url, **kw: redis.asyncio.ConnectionPool(
+        connection_class=async_connection, server=server, **pool_kwargs(kw)))
+    redis.asyncio.BlockingConnectionPool.from_url = classmethod(lambda cls, url, **kw: redis.asyncio.BlockingConnectionPool(
+        connection_class=async_connection, server=server, **pool_kwargs(kw)))
+    return server
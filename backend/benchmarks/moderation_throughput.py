@@ -0,0 +1,61 @@
+"""Moderation throughput in MB/s of text.
+
+Run from backend/: python -m benchmarks.moderation_throughput [--mb 8] [--chunk 40]
+"""
+import argparse
+import json
+import random
+import time
+
+from moderation_service import ModerationService
+
+WORDS = ("the quick brown fox jumps over a lazy dog while she smiles softly and "
+         "asks about your day at the old library near the river").split()
+
+def make_corpus(size_bytes: int, seed: int = 7) -> str:
+    rng = random.Random(seed)
+    words = []
+    total = 0
+    while total < size_bytes:
+        word = rng.choice(WORDS)
+        words.append(word)
+        total += len(word) + 1
+    return " ".join(words)
+
+def measure(fn, size_bytes: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return size_bytes / best / (1024 * 1024)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mb", type=float, default=8.0, help="corpus size in MB")
+    parser.add_argument("--chunk", type=int, default=40, help="characters per streamed chunk")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    service = ModerationService()
+    text = make_corpus(int(args.mb * 1024 * 1024))
+    size = len(text.encode("utf-8"))
+    chunks = [text[i:i + args.chunk] for i in range(0, len(text), args.chunk)]
+
+    def streamed():
+        moderator = service.stream()
+        for chunk in chunks:
+            moderator.feed(chunk)
+        moderator.finish()
+
+    results = {
+        "corpus_bytes": size,
+        "chunk_chars": args.chunk,
+        "filter_content_mb_s": round(measure(lambda: service.filter_content(text), size, args.repeat), 2),
+        "clean_prompt_injection_mb_s": round(measure(lambda: service.clean_prompt_injection(text), size, args.repeat), 2),
+        "stream_mb_s": round(measure(streamed, size, args.repeat), 2),
+    }
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+class CatalogEntry:
+    def __init__(self, body: bytes, headers: Dict[str, str], expires_at: float):
+        self.body = body
+        self.headers = headers
+        self.etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        self.expires_at = expires_at
+
+class CatalogCache:
+    """Serialized catalog pages, cached per catalog version.
+
+    The version lives in Redis so that create/update in any worker invalidates
+    every worker; it is re-read at most once per version_check_interval. Entries
+    also expire after `ttl` seconds so counters like interaction_count refresh.
+    """
+    VERSION_KEY = "catalog:version"
+
+    def __init__(self, redis_client=None, ttl: float = 30.0, max_entries: int = 256, version_check_interval: float = 1.0):
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version_check_interval = version_check_interval
+        self._entries: "OrderedDict[Hashable, CatalogEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._version: Optional[str] = None
+        self._version_checked = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def _current_version(self) -> Optional[str]:
+        now = time.monotonic()
+        if self.redis_client is None or now - self._version_checked < self.version_check_interval:
+            return self._version
+        try:
+            version = self.redis_client.get(self.VERSION_KEY)
+        except Exception as e:
+            print(f"Warning: catalog version check failed: {e}")
+            return self._version
+        self._version_checked = now
+        if version != self._version:
+            with self._lock:
+                self._entries.clear()
+            self._version = version
+        return version
+
+    def get(self, key: Hashable) -> Optional[CatalogEntry]:
+        self._current_version()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at < time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Hashable, body: bytes, headers: Optional[Dict[str, str]] = None) -> CatalogEntry:
+        entry = CatalogEntry(body, headers or {}, time.monotonic() + self.ttl)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self):
+        """Drops cached pages here and, through the shared version, in every other worker."""
+        with self._lock:
+            self._entries.clear()
+        if self.redis_client is not None:
+            try:
+                self._version = str(self.redis_client.incr(self.VERSION_KEY))
+                self._version_checked = time.monotonic()
+            except Exception as e:
+                print(f"Warning: catalog invalidation not shared: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "version": self._version}
@@ -0,0 +1,105 @@
+import os
+import re
+from typing import Any, Dict, List
+
+# CJK characters are roughly one token each; other text averages ~4 characters per token
+_WIDE_CHARS = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]")
+MESSAGE_OVERHEAD_TOKENS = 4
+MIN_TRUNCATED_TOKENS = 32
+
+def estimate_tokens(text: str) -> int:
+    """Fast local token estimate; no tokenizer round trip."""
+    if not text:
+        return 0
+    wide = len(_WIDE_CHARS.findall(text))
+    return wide + (len(text) - wide + 3) // 4
+
+def truncate_to_tokens(text: str, tokens: int, keep_end: bool = False) -> str:
+    """Cuts text down to roughly `tokens`, keeping the start (or the end)."""
+    if estimate_tokens(text) <= tokens:
+        return text
+    lo, hi = 0, len(text)
+    # Binary search on length since wide characters make the ratio uneven
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        piece = text[-mid:] if keep_end else text[:mid]
+        if estimate_tokens(piece) + 1 <= tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    piece = text[-lo:] if keep_end else text[:lo]
+    return "…" + piece if keep_end else piece + "…"
+
+class ContextAssembler:
+    """Packs long-term memories and recent turns into a prompt token budget.
+
+    The persona/state prompt and the user message are always included. The rest
+    of the budget is filled greedily by value: recent turns decay with age,
+    memories with retrieval rank. History is kept as a contiguous run of the
+    newest turns; an item that no longer fits is truncated if enough room is
+    left, and everything of lower value is dropped.
+    """
+    def __init__(self, token_budget: int = 4000, turn_weight: float = 1.0, memory_weight: float = 0.9, decay: float = 0.5):
+        self.token_budget = token_budget
+        self.turn_weight = turn_weight
+        self.memory_weight = memory_weight
+        self.decay = decay
+
+    @classmethod
+    def from_env(cls) -> "ContextAssembler":
+        return cls(token_budget=int(os.getenv("CONTEXT_TOKEN_BUDGET", "4000")))
+
+    def assemble(self, fixed: List[str], memories: List[str], history: List[Dict[str, str]]) -> Dict[str, Any]:
+        used = sum(estimate_tokens(text) for text in fixed)
+        remaining = self.token_budget - used
+
+        chosen_memories: List[str] = []
+        chosen_turns: List[Dict[str, str]] = []
+        mem_i, turn_i = 0, 0
+        memories_open, turns_open = True, True
+        truncated = 0
+
+        while remaining > 0 and ((memories_open and mem_i < len(memories)) or (turns_open and turn_i < len(history))):
+            turn_value = self.turn_weight / (1 + turn_i * self.decay) if turns_open and turn_i < len(history) else -1.0
+            mem_value = self.memory_weight / (1 + mem_i) if memories_open and mem_i < len(memories) else -1.0
+
+            if turn_value >= mem_value:
+                turn = history[len(history) - 1 - turn_i]
+                cost = estimate_tokens(turn["content"]) + MESSAGE_OVERHEAD_TOKENS
+                if cost <= remaining:
+                    chosen_turns.append(turn)
+                    remaining -= cost
+                    turn_i += 1
+                    continue
+                # Older turns would leave a gap, so the history stops here
+                turns_open = False
+                if remaining - MESSAGE_OVERHEAD_TOKENS >= MIN_TRUNCATED_TOKENS:
+                    content = truncate_to_tokens(turn["content"], remaining - MESSAGE_OVERHEAD_TOKENS, keep_end=True)
+                    chosen_turns.append({**turn, "content": content})
+                    remaining -= estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+                    turn_i += 1
+                    truncated += 1
+            else:
+                memory = memories[mem_i]
+                cost = estimate_tokens(memory) + 1
+                if cost <= remaining:
+                    chosen_memories.append(memory)
+                    remaining -= cost
+                    mem_i += 1
+                    continue
+                memories_open = False
+                if remaining >= MIN_TRUNCATED_TOKENS:
+                    memory = truncate_to_tokens(memory, remaining - 1)
+                    chosen_memories.append(memory)
+                    remaining -= estimate_tokens(memory) + 1
+                    mem_i += 1
+                    truncated += 1
+
+        chosen_turns.reverse()
+        return {
+            "memories": chosen_memories,
+            "history": chosen_turns,
+            "prompt_tokens": self.token_budget - remaining,
+            "dropped": (len(memories) - mem_i) + (len(history) - turn_i),
+            "truncated": truncated,
+        }
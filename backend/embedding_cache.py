@@ -0,0 +1,206 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from chromadb.utils import embedding_functions
+from dotenv import load_dotenv
+from metrics import stage
+
+load_dotenv()
+
+def _binary_client(redis_url: Optional[str]):
+    """Bounded client of its own, for a separate cache server or callers without the app's pools."""
+    if not redis_url:
+        return None
+    import redis
+    return redis.Redis.from_url(redis_url, max_connections=int(os.getenv("REDIS_BINARY_CONNECTIONS", "10")))
+
+class RedisVectorStore:
+    """Shared cache tier in Redis; vectors are stored as raw float32 bytes.
+
+    `client` must not decode responses; the app passes its pooled binary client.
+    """
+    def __init__(self, client, ttl: Optional[int] = None, prefix: str = "emb:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        return self.client.mget([self.prefix + k for k in keys])
+
+    def set_many(self, items: Dict[str, bytes]):
+        pipe = self.client.pipeline()
+        for key, value in items.items():
+            pipe.set(self.prefix + key, value, ex=self.ttl)
+        pipe.execute()
+
+class DiskVectorStore:
+    """Shared cache tier on a local volume, one file per vector."""
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key)
+
+    def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        values: List[Optional[bytes]] = []
+        for key in keys:
+            try:
+                with open(self._file(key), "rb") as f:
+                    values.append(f.read())
+            except FileNotFoundError:
+                values.append(None)
+        return values
+
+    def set_many(self, items: Dict[str, bytes]):
+        for key, value in items.items():
+            target = self._file(key)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # Write then rename so concurrent workers never read a partial vector
+            tmp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(value)
+            os.replace(tmp, target)
+
+class CachedEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Content-addressed cache in front of a Chroma embedding function.
+
+    Vectors are keyed by a hash of the model name and text. Lookups go through a
+    bounded in-process LRU, then an optional shared tier (Redis or disk), and only
+    the remaining misses are sent to the model in a single batch.
+    """
+    def __init__(self, inner: EmbeddingFunction, max_items: int = 10000, max_bytes: int = 64 * 1024 * 1024, shared=None):
+        self.inner = inner
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.shared = shared
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls, inner: EmbeddingFunction, redis_client=None) -> "CachedEmbeddingFunction":
+        """`redis_client` (not decoding responses) serves the Redis tier unless EMBEDDING_CACHE_REDIS_URL names another server."""
+        shared = None
+        tier = os.getenv("EMBEDDING_CACHE_SHARED", "").lower()
+        if tier == "redis":
+            ttl = os.getenv("EMBEDDING_CACHE_TTL")
+            separate_url = os.getenv("EMBEDDING_CACHE_REDIS_URL")
+            if separate_url or redis_client is None:
+                redis_client = _binary_client(separate_url or os.getenv("REDIS_URL"))
+            if redis_client is not None:
+                shared = RedisVectorStore(redis_client, ttl=int(ttl) if ttl else None)
+        elif tier == "disk":
+            shared = DiskVectorStore(os.getenv("EMBEDDING_CACHE_DIR", "./db/embedding_cache"))
+        return cls(
+            inner,
+            max_items=int(os.getenv("EMBEDDING_CACHE_MAX_ITEMS", "10000")),
+            max_bytes=int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            shared=shared
+        )
+
+    def __call__(self, input: Documents) -> Embeddings:
+        keys = [self._key(text) for text in input]
+        results: List[Optional[np.ndarray]] = [None] * len(keys)
+        missing: List[int] = []
+
+        # 1. In-process LRU
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._lru.get(key)
+                if vector is not None:
+                    self._lru.move_to_end(key)
+                    results[i] = vector
+                    self.hits += 1
+                else:
+                    missing.append(i)
+
+        # 2. Shared tier
+        if missing and self.shared is not None:
+            try:
+                found = self.shared.get_many([keys[i] for i in missing])
+            except Exception as e:
+                print(f"Warning: embedding cache shared tier unavailable: {e}")
+                found = [None] * len(missing)
+            still_missing = []
+            for i, raw in zip(missing, found):
+                if raw is None:
+                    still_missing.append(i)
+                    continue
+                results[i] = np.frombuffer(raw, dtype=np.float32)
+                self._remember(keys[i], results[i])
+                self.shared_hits += 1
+            missing = still_missing
+
+        # 3. Model inference for the rest, in one batch
+        if missing:
+            # Identical texts in the same batch are embedded once
+            unique: Dict[str, str] = {}
+            for i in missing:
+                unique.setdefault(keys[i], input[i])
+            with stage("embedding"):
+                vectors = self.inner(list(unique.values()))
+            computed = {key: np.asarray(vector, dtype=np.float32) for key, vector in zip(unique.keys(), vectors)}
+            for i in missing:
+                results[i] = computed[keys[i]]
+            for key, vector in computed.items():
+                self._remember(key, vector)
+            self.misses += len(missing)
+            if self.shared is not None:
+                try:
+                    self.shared.set_many({key: vector.tobytes() for key, vector in computed.items()})
+                except Exception as e:
+                    print(f"Warning: embedding cache shared tier unavailable: {e}")
+
+        return [r for r in results if r is not None]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            "items": len(self._lru),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.shared_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.inner.name()}\0{text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: np.ndarray):
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                return
+            self._lru[key] = vector
+            self._bytes += vector.nbytes
+            while self._lru and (len(self._lru) > self.max_items or self._bytes > self.max_bytes):
+                _, evicted = self._lru.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    # Chroma persists the embedding function config with the collection, so the
+    # wrapper reports the wrapped function's identity.
+    def name(self) -> str:  # type: ignore[override]
+        return self.inner.name()
+
+    def get_config(self) -> Dict[str, Any]:
+        return self.inner.get_config()
+
+    def default_space(self):
+        return self.inner.default_space()
+
+    def supported_spaces(self):
+        return self.inner.supported_spaces()
+
+    @staticmethod
+    def build_from_config(config: Dict[str, Any]) -> "CachedEmbeddingFunction":
+        return CachedEmbeddingFunction.from_env(embedding_functions.DefaultEmbeddingFunction.build_from_config(config))
@@ -0,0 +1,131 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict
+
+import redis
+from sqlalchemy import bindparam, delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session
+
+from models import Character, CounterFlush
+
+class InteractionCounter:
+    """Buffers Character.interaction_count increments in Redis and applies them in bulk.
+
+    Each chat turn is a single HINCRBY instead of a row-locking UPDATE. A flush
+    atomically renames the pending hash to a batch key, then applies the whole
+    batch in one transaction that also records the batch id in CounterFlush.
+    Batches left behind by a crashed worker are retried on the next flush, and
+    the recorded id makes that retry a no-op if the first attempt committed.
+    """
+    PENDING_KEY = "interactions:pending"
+    BATCHES_KEY = "interactions:batches"
+
+    def __init__(self, redis_client, engine, flush_interval: float = 10.0):
+        self.redis_client = redis_client
+        self.engine = engine
+        self.flush_interval = flush_interval
+        self._task = None
+
+    def _batch_key(self, batch_id: str) -> str:
+        return f"interactions:batch:{batch_id}"
+
+    def incr(self, character_id: int, amount: int = 1):
+        try:
+            self.redis_client.hincrby(self.PENDING_KEY, str(character_id), amount)
+        except redis.RedisError as e:
+            print(f"Warning: interaction count for character {character_id} not recorded: {e}")
+
+    def pending(self) -> Dict[int, int]:
+        """Increments not yet persisted, including batches being flushed."""
+        keys = [self.PENDING_KEY] + [self._batch_key(b) for b in self.redis_client.smembers(self.BATCHES_KEY)]
+        pipe = self.redis_client.pipeline()
+        for key in keys:
+            pipe.hgetall(key)
+        totals: Dict[int, int] = {}
+        for counts in pipe.execute():
+            for character_id, delta in counts.items():
+                totals[int(character_id)] = totals.get(int(character_id), 0) + int(delta)
+        return totals
+
+    def flush(self) -> int:
+        """Applies leftover batches, then the current pending counts; returns increments applied."""
+        applied = 0
+        for batch_id in self.redis_client.smembers(self.BATCHES_KEY):
+            applied += self._apply_batch(batch_id)
+
+        batch_id = uuid.uuid4().hex
+        pipe = self.redis_client.pipeline()
+        pipe.sadd(self.BATCHES_KEY, batch_id)
+        pipe.rename(self.PENDING_KEY, self._batch_key(batch_id))
+        try:
+            pipe.execute()
+        except redis.ResponseError:
+            # Nothing pending (or another worker just took it)
+            self.redis_client.srem(self.BATCHES_KEY, batch_id)
+            return applied
+        return applied + self._apply_batch(batch_id)
+
+    def _apply_batch(self, batch_id: str) -> int:
+        key = self._batch_key(batch_id)
+        counts = {int(k): int(v) for k, v in self.redis_client.hgetall(key).items()}
+        applied = 0
+        if counts:
+            table = Character.__table__
+            stmt = (
+                update(table)
+                .where(table.c.id == bindparam("character_id"))
+                .values(interaction_count=table.c.interaction_count + bindparam("delta"))
+            )
+            try:
+                with Session(self.engine) as session:
+                    if session.get(CounterFlush, batch_id) is None:
+                        # Sorted ids keep lock order stable across concurrent flushes
+                        params = [{"character_id": cid, "delta": delta} for cid, delta in sorted(counts.items())]
+                        session.connection().execute(stmt, params)
+                        session.add(CounterFlush(batch_id=batch_id))
+                        session.commit()
+                        applied = sum(counts.values())
+            except IntegrityError:
+                # Another worker committed this batch first
+                pass
+        pipe = self.redis_client.pipeline()
+        pipe.delete(key)
+        pipe.srem(self.BATCHES_KEY, batch_id)
+        pipe.execute()
+        return applied
+
+    def prune(self, older_than: timedelta = timedelta(days=1)):
+        """Forgets applied batch ids once no worker could still retry them."""
+        with Session(self.engine) as session:
+            session.connection().execute(delete(CounterFlush.__table__).where(CounterFlush.__table__.c.created_at < datetime.utcnow() - older_than))
+            session.commit()
+
+    async def run(self):
+        """Flushes every flush_interval seconds until cancelled."""
+        loop = asyncio.get_running_loop()
+        last_prune = loop.time()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await loop.run_in_executor(None, self.flush)
+                if loop.time() - last_prune > 3600:
+                    await loop.run_in_executor(None, self.prune)
+                    last_prune = loop.time()
+            except Exception as e:
+                print(f"Warning: interaction counter flush failed: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.flush)
+        except Exception as e:
+            # Whatever is left stays in Redis for the next worker's flush
+            print(f"Warning: final interaction counter flush failed: {e}")
@@ -1,19 +1,38 @@
-from fastapi import FastAPI, HTTPException, Depends, File, UploadFile, Response
+from fastapi import FastAPI, HTTPException, Depends, File, UploadFile, Response, Request
 import os
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
-from sqlmodel import Session, select, create_engine, SQLModel
-from typing import List
+from starlette.background import BackgroundTask
+from fastapi.encoders import jsonable_encoder
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel import Session, select, SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import List, Optional, Union
+from datetime import datetime
+from sqlalchemy import and_, or_, text
+import base64
 import json
+import uuid
 import asyncio
+import time
+from contextlib import aclosing, asynccontextmanager
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from models import User, Character, ChatSession, Message
-from ai_service import AIService
-from memory_service import MemoryService
-from moderation_service import ModerationService
+from models import User, Character, CharacterSummary, CharacterUpdate, ChatSession, Message
+from ai_service import AIService, StateStreamParser
+from moderation_service import ModerationService, StreamModerator, BLOCKED_MESSAGE
+from context_assembler import ContextAssembler
+from resources import Resources
+from catalog_cache import CatalogCache
+from interaction_counter import InteractionCounter
+from session_state import SessionStateCache
+from multimodal_service import MultiModalService, SentenceSplitter, TurnTextChannel
+from admission import AdmissionController, AdmissionSlot
+from audio_upload import PreparedAudio, UploadLimitMiddleware, prepare_upload, MAX_UPLOAD_BYTES
+import metrics
+from metrics import stage
 
 # Database setup
 database_url = os.getenv("DATABASE_URL")
@@ -22,12 +41,240 @@ if not database_url:
     print(f"DEBUG: Available environment keys: {list(os.environ.keys())}")
     print("Please ensure you have added DATABASE_URL to your Railway Variables tab.")
     raise RuntimeError("DATABASE_URL not found in environment")
-engine = create_engine(database_url)
+# Session state, counters, caches and memory all live in Redis
+redis_url = os.getenv("REDIS_URL")
+if not redis_url:
+    raise RuntimeError("REDIS_URL not found in environment")
+# Shared, tuned connection pools for the database, Redis and outbound HTTP
+resources = Resources(database_url, redis_url)
+engine = resources.engine
+async_engine = resources.async_engine
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    # create_all skips indexes on tables that already exist
+    for index in Message.__table__.indexes:
+        index.create(engine, checkfirst=True)
 
-app = FastAPI(title="O ai API", version="1.0.0")
+async def get_recent_history(session_id: int, limit: int) -> List[dict]:
+    """Fetches only the last `limit` messages of a session, oldest first."""
+    with stage("db_history"):
+        async with AsyncSession(async_engine) as session:
+            rows = (await session.exec(
+                select(Message.role, Message.content)
+                .where(Message.session_id == session_id)
+                .order_by(Message.created_at.desc(), Message.id.desc())
+                .limit(limit)
+            )).all()
+    return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+async def load_turn_state(session_id: int):
+    """Hot session state and its character; (None, None) if the session does not exist."""
+    with stage("session_state"):
+        chat_state = await session_state.get_async(session_id)
+    if not chat_state:
+        return None, None
+    with stage("db_character"):
+        async with AsyncSession(async_engine) as session:
+            character = await session.get(Character, chat_state["character_id"])
+    return chat_state, character
+
+async def gather_turn_context(session_id: int, memory_query: str):
+    """Runs the pre-generation lookups concurrently.
+
+    Session state plus character, long-term memory and recent history do not
+    depend on each other, so the wait before generation is the slowest of the
+    three rather than their sum.
+    """
+    with stage("context"):
+        (chat_state, character), memories, history = await asyncio.gather(
+            load_turn_state(session_id),
+            memory_service.get_context_async(str(session_id), memory_query, n_results=MEMORY_CANDIDATES),
+            get_recent_history(session_id, HISTORY_CANDIDATES),
+        )
+    if not chat_state:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return chat_state, character, memories, history
+
+async def record_user_turn(message: Message, character_id: int):
+    """Saves the user message, records it in memory and counts the interaction."""
+    session_id, content = message.session_id, message.content
+    with stage("db_user_turn"):
+        async with AsyncSession(async_engine) as session:
+            session.add(message)
+            await session.flush()
+            message_id = message.id
+            await session.commit()
+    # Long-term memory keeps both sides of the conversation, keyed by message id
+    await asyncio.to_thread(memory_service.add_message, str(session_id), "user", content, message_id)
+    # Increment interaction count (buffered in Redis, flushed to the table in bulk)
+    await asyncio.to_thread(interaction_counter.incr, character_id)
+
+def report_failure(task: asyncio.Task):
+    """Done callback: logs the error of a task that may never be awaited (e.g. after a disconnect)."""
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Warning: {task.get_name()} failed: {task.exception()}")
+
+async def build_prompt(character: Character, current_state: dict, memories: List[str], history: List[dict], user_message: str):
+    """Packs persona, state, memories and recent turns into the context token budget."""
+    with stage("prompt"):
+        persona_prompt = await ai_service.format_prompt(character, "", current_state)
+        packed = context_assembler.assemble([persona_prompt, user_message], memories, history)
+        system_prompt = await ai_service.format_prompt(character, "\n".join(packed["memories"]), current_state)
+    return system_prompt, packed["history"], packed
+
+def prompt_headers(packed: dict) -> dict:
+    return {
+        "X-Prompt-Tokens": str(packed["prompt_tokens"]),
+        "X-Context-Dropped": str(packed["dropped"]),
+    }
+
+async def moderated_text(response, parser: StateStreamParser, moderator: StreamModerator):
+    """Yields reply text with the state block stripped, stopping at the first moderation hit."""
+    # Closing the chunk stream (on a hit or a client disconnect) cancels the Gemini call
+    async with aclosing(ai_service.stream_text(response)) as chunks:
+        async for text in chunks:
+            safe = moderator.feed(parser.feed(text))
+            if moderator.blocked:
+                return
+            if safe:
+                yield safe
+    safe = moderator.feed(parser.finish()) + moderator.finish()
+    if safe:
+        yield safe
+
+def save_assistant_turn(session_id: int, clean_content: str, state_update: Optional[dict]):
+    """Saves the assistant message, applies the state update and records the turn in memory."""
+    with stage("db_assistant_turn"), Session(engine) as session:
+        asst_msg = Message(session_id=session_id, role="assistant", content=clean_content)
+        session.add(asst_msg)
+        session.commit()
+        message_id = asst_msg.id
+
+    with stage("persist_state"):
+        # Update Session State: atomic clamp-and-add and tag union in Redis, written back in batches
+        if state_update:
+            session_state.apply(session_id, state_update["delta"], state_update["tags"])
+        memory_service.add_message(str(session_id), "assistant", clean_content, message_id=message_id)
+
+def encode_cursor(message: Message) -> str:
+    return base64.urlsafe_b64encode(f"{message.created_at.isoformat()}|{message.id}".encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(message_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+# Built by init_services() once the worker is serving: importing Chroma and the Gemini SDK
+# and opening the vector store would otherwise delay every worker's bind by seconds
+ai_service: Optional[AIService] = None
+memory_service = None
+memory_synthesizer = None
+memory_reindexer = None
+session_state = SessionStateCache(
+    resources.redis_client, engine,
+    flush_interval=float(os.getenv("SESSION_STATE_FLUSH_INTERVAL", "5")),
+    async_redis_client=resources.async_redis_client
+)
+interaction_counter = InteractionCounter(resources.redis_client, engine, flush_interval=float(os.getenv("INTERACTION_FLUSH_INTERVAL", "10")))
+catalog_cache = CatalogCache(resources.redis_client, ttl=float(os.getenv("CATALOG_CACHE_TTL", "30")))
+moderation_service = ModerationService()
+context_assembler = ContextAssembler.from_env()
+# Fair, bounded access to the LLM; coordinated across workers when LLM_CLUSTER_MAX_CONCURRENCY is set
+admission = AdmissionController.from_env(resources.async_redis_client)
+multi_modal_service = MultiModalService()
+voice_text_channel = TurnTextChannel(resources.async_redis_client, resources.async_redis_listen_client)
+VOICE_TTS_CONCURRENCY = int(os.getenv("VOICE_TTS_CONCURRENCY", "2"))
+
+# Candidates offered to the context assembler; the token budget decides how many are sent
+MEMORY_CANDIDATES = int(os.getenv("CONTEXT_MEMORY_CANDIDATES", "8"))
+HISTORY_CANDIDATES = int(os.getenv("CONTEXT_HISTORY_CANDIDATES", "40"))
+
+# Requests needing the heavy services wait this long for warmup before a 503
+STARTUP_WAIT_SECONDS = float(os.getenv("STARTUP_WAIT_SECONDS", "30"))
+services_ready = asyncio.Event()
+startup = {"services_seconds": None, "warmup_seconds": None, "error": None}
+
+def init_services():
+    """Builds the heavy services; services already set (e.g. fakes in benchmarks) are kept."""
+    global ai_service, memory_service, memory_synthesizer, memory_reindexer
+    from memory_service import MemoryService
+    from memory_synthesizer import MemorySynthesizer
+    from memory_reindex import MemoryReindexer
+    if ai_service is None:
+        ai_service = AIService()
+    if memory_service is None:
+        memory_service = MemoryService(redis_client=resources.redis_client, async_redis_client=resources.async_redis_client,
+                                       binary_redis_client=resources.redis_binary_client)
+    if memory_synthesizer is None:
+        memory_synthesizer = MemorySynthesizer(ai_service, memory_service, engine, admission=admission)
+    if memory_reindexer is None:
+        # In-app backfill embeds on a thread with the cached function; the CLI can use a process pool
+        memory_reindexer = MemoryReindexer(memory_service, engine, batch_size=int(os.getenv("MEMORY_REINDEX_BATCH_SIZE", "128")))
+
+def warm_embeddings():
+    """One uncached inference loads the embedding model before the first real query needs it."""
+    memory_service.embedding_function.inner(["warmup"])
+
+async def warm_up():
+    started = time.perf_counter()
+    try:
+        await run_in_threadpool(init_services)
+        startup["services_seconds"] = round(time.perf_counter() - started, 3)
+        if os.getenv("MEMORY_SYNTHESIS_ENABLED", "true").lower() == "true":
+            memory_synthesizer.start()
+        await run_in_threadpool(warm_embeddings)
+        startup["warmup_seconds"] = round(time.perf_counter() - started, 3)
+        services_ready.set()
+        print(f"Services ready in {startup['warmup_seconds']:.1f}s")
+    except Exception as e:
+        startup["error"] = str(e)
+        print(f"Warning: service warmup failed: {e}")
+
+async def require_services():
+    """Holds a request until the heavy services are up, or fails it with 503."""
+    if services_ready.is_set():
+        return
+    if startup["error"] is None:
+        try:
+            await asyncio.wait_for(services_ready.wait(), STARTUP_WAIT_SECONDS)
+            return
+        except asyncio.TimeoutError:
+            pass
+    raise HTTPException(status_code=503, detail="Service is starting", headers={"Retry-After": "5"})
+
+async def shutdown_step(name: str, step):
+    """Runs one shutdown step; a failure is logged so the remaining steps still run."""
+    try:
+        result = step()
+        if asyncio.iscoroutine(result):
+            await result
+    except Exception as e:
+        print(f"Warning: shutdown of {name} failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_in_threadpool(create_db_and_tables)
+    await resources.start()
+    multi_modal_service.http_client = resources.http_client
+    interaction_counter.start()
+    session_state.start()
+    # Services load and warm up in the background so the worker binds at once; /readyz says when they are done
+    warmup = asyncio.create_task(warm_up())
+    yield
+    warmup.cancel()
+    if memory_synthesizer is not None:
+        await shutdown_step("memory synthesizer", memory_synthesizer.stop)
+    await shutdown_step("interaction counter", interaction_counter.stop)
+    await shutdown_step("session state", session_state.stop)
+    if memory_service is not None:
+        await shutdown_step("memory service", lambda: run_in_threadpool(memory_service.close))
+    multi_modal_service.http_client = None
+    await shutdown_step("connection pools", resources.close)
+
+app = FastAPI(title="O ai API", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -35,32 +282,182 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let browser code read the response metadata headers
+    expose_headers=["ETag", "X-Next-Cursor", "X-Response-Text", "X-Turn-Id", "X-Text-Url", "X-Prompt-Tokens", "X-Context-Dropped", "Server-Timing"],
 )
+# Per-stage timings of each request, as a Server-Timing header
+app.add_middleware(metrics.ServerTimingMiddleware)
+# Oversized voice uploads are refused before the multipart body is buffered (plus room for form framing)
+app.add_middleware(UploadLimitMiddleware, path_prefix="/chat/voice/", max_bytes=MAX_UPLOAD_BYTES + 64 * 1024)
 
-ai_service = AIService()
-memory_service = MemoryService()
-moderation_service = ModerationService()
+# Queue depths and pool usage, read only when /metrics is scraped
+metrics.gauge("oai_memory_ingest_depth", "Messages waiting to be embedded", lambda: memory_service.ingest_queue.stats()["depth"])
+metrics.gauge("oai_memory_ingest_oldest_seconds", "Age of the oldest message waiting to be embedded", lambda: memory_service.ingest_queue.stats()["oldest_pending_seconds"])
+metrics.gauge("oai_session_state_dirty", "Session states not yet written back", lambda: resources.redis_client.hlen(SessionStateCache.DIRTY_KEY))
+metrics.gauge("oai_interactions_pending_characters", "Characters with buffered interaction counts", lambda: resources.redis_client.hlen(InteractionCounter.PENDING_KEY))
+metrics.gauge("oai_embedding_cache_hit_rate", "Embedding cache hit rate since start", lambda: memory_service.embedding_function.stats()["hit_rate"])
+metrics.gauge("oai_db_pool_checked_out", "Database connections in use", lambda: resources.engine.pool.checkedout())
+metrics.gauge("oai_db_async_pool_checked_out", "Async database connections in use", lambda: resources.async_engine.pool.checkedout())
+metrics.gauge("oai_llm_active", "LLM calls holding an admission slot", lambda: admission.active)
+metrics.gauge("oai_llm_queued", "Turns waiting for an LLM slot", lambda: admission.queued)
 
-@app.on_event("startup")
-def on_startup():
-    create_db_and_tables()
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus exposition of stage latencies, turn counters and queue depths."""
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/healthz")
+def healthz(response: Response):
+    """Liveness: the worker is serving; fails only if service warmup broke."""
+    if startup["error"]:
+        response.status_code = 500
+        return {"status": "error", "error": startup["error"]}
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz(response: Response):
+    """Readiness: services warmed up and the database and Redis answering."""
+    checks = {"services": services_ready.is_set()}
+    try:
+        checks["redis"] = bool(await resources.async_redis_client.ping())
+    except Exception:
+        checks["redis"] = False
+    try:
+        async with async_engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+        checks["database"] = True
+    except Exception:
+        checks["database"] = False
+    ready = all(checks.values())
+    response.status_code = 200 if ready else 503
+    return {"ready": ready, "checks": checks, **startup}
+
+@app.get("/pools")
+def pool_stats():
+    """Connection pool usage for the database, Redis and outbound HTTP."""
+    return resources.stats()
+
+def sse_event(event: str, data: str) -> str:
+    """Formats one Server-Sent Event; multi-line data is split across data: fields."""
+    lines = "".join(f"data: {line}\n" for line in data.split("\n"))
+    return f"event: {event}\n{lines}\n"
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to O ai API"}
 
+@app.get("/admission")
+def admission_stats():
+    """LLM slots in use and turns waiting for one."""
+    return admission.stats()
+
+@app.get("/memory/ingest", dependencies=[Depends(require_services)])
+def memory_ingest_stats():
+    """Depth and lag of the background memory ingest queue."""
+    return memory_service.ingest_queue.stats()
+
+@app.get("/memory/embedding-cache", dependencies=[Depends(require_services)])
+def embedding_cache_stats():
+    """Hit/miss counters and size of the embedding cache."""
+    return memory_service.embedding_function.stats()
+
+@app.get("/memory/reindex", dependencies=[Depends(require_services)])
+def memory_reindex_status():
+    """Checkpoint and throughput of the memory backfill."""
+    return memory_reindexer.checkpoint()
+
+@app.post("/memory/reindex", dependencies=[Depends(require_services)])
+def start_memory_reindex(reset: bool = False):
+    """Starts (or resumes) backfilling long-term memory from the Message table in the background."""
+    if reset:
+        try:
+            memory_reindexer.reset()
+        except RuntimeError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    started = memory_reindexer.start()
+    return {"started": started, **memory_reindexer.checkpoint()}
+
+@app.get("/memory/partitions", dependencies=[Depends(require_services)])
+def memory_partition_stats():
+    """Partition count, per-partition vector counts and any pending rebalance."""
+    return memory_service.partitions.stats()
+
 @app.post("/characters/", response_model=Character)
 def create_character(character: Character):
     with Session(engine) as session:
         session.add(character)
         session.commit()
         session.refresh(character)
+        catalog_cache.invalidate()
         return character
 
-@app.get("/characters/", response_model=List[Character])
-def read_characters():
+@app.patch("/characters/{character_id}", response_model=Character)
+def update_character(character_id: int, update: CharacterUpdate):
     with Session(engine) as session:
-        return session.exec(select(Character)).all()
+        character = session.get(Character, character_id)
+        if not character:
+            raise HTTPException(status_code=404, detail="Character not found")
+        for key, value in update.model_dump(exclude_unset=True).items():
+            setattr(character, key, value)
+        session.add(character)
+        session.commit()
+        session.refresh(character)
+        catalog_cache.invalidate()
+        return character
+
+def catalog_response(request: Request, entry) -> Response:
+    """Serves a cached catalog entry, or 304 when the client already has it."""
+    headers = {"ETag": entry.etag, "Cache-Control": "public, max-age=0, must-revalidate", **entry.headers}
+    if_none_match = request.headers.get("if-none-match", "")
+    if entry.etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+@app.get("/characters/", response_model=Union[List[Character], List[CharacterSummary]])
+def read_characters(request: Request, view: str = "full", cursor: Optional[int] = None, limit: int = 50):
+    """Cursor-paginated catalog. view=summary skips prompts, traits and few-shot examples."""
+    if view not in ("full", "summary"):
+        raise HTTPException(status_code=400, detail="view must be 'full' or 'summary'")
+    limit = max(1, min(limit, 200))
+    key = (view, cursor, limit)
+    entry = catalog_cache.get(key)
+    if entry is None:
+        with Session(engine) as session:
+            if view == "summary":
+                query = select(*(getattr(Character, name) for name in CharacterSummary.model_fields))
+            else:
+                query = select(Character)
+            if cursor is not None:
+                query = query.where(Character.id > cursor)
+            rows = session.exec(query.order_by(Character.id).limit(limit + 1)).all()
+        page = rows[:limit]
+        if view == "summary":
+            items = [dict(zip(CharacterSummary.model_fields, row)) for row in page]
+        else:
+            items = [jsonable_encoder(row) for row in page]
+        # Persisted counts plus increments still buffered in Redis
+        pending = interaction_counter.pending()
+        for item in items:
+            item["interaction_count"] += pending.get(item["id"], 0)
+        headers = {}
+        if len(rows) > limit:
+            headers["X-Next-Cursor"] = str(items[-1]["id"])
+        entry = catalog_cache.put(key, json.dumps(jsonable_encoder(items)).encode(), headers)
+    return catalog_response(request, entry)
+
+@app.get("/characters/{character_id}", response_model=Character)
+def read_character(request: Request, character_id: int):
+    entry = catalog_cache.get(("one", character_id))
+    if entry is None:
+        with Session(engine) as session:
+            character = session.get(Character, character_id)
+            if not character:
+                raise HTTPException(status_code=404, detail="Character not found")
+            item = jsonable_encoder(character)
+            item["interaction_count"] += interaction_counter.pending().get(character_id, 0)
+            entry = catalog_cache.put(("one", character_id), json.dumps(item).encode())
+    return catalog_response(request, entry)
 
 # Authentication Endpoints
 @app.post("/auth/register")
@@ -93,128 +490,243 @@ def create_session(session_data: ChatSession):
         session.refresh(session_data)
         return session_data
 
-@app.post("/chat/{session_id}")
-async def chat(session_id: int, user_message: str):
+@app.get("/sessions/{session_id}/messages")
+def read_messages(session_id: int, before: Optional[str] = None, limit: int = 50):
+    """Keyset-paginated history, scrolling back from the newest message."""
+    limit = max(1, min(limit, 200))
+    with Session(engine) as session:
+        query = select(Message).where(Message.session_id == session_id)
+        if before:
+            created_at, message_id = decode_cursor(before)
+            query = query.where(or_(
+                Message.created_at < created_at,
+                and_(Message.created_at == created_at, Message.id < message_id)
+            ))
+        rows = session.exec(query.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit + 1)).all()
+        page = rows[:limit]
+        next_cursor = encode_cursor(page[-1]) if len(rows) > limit else None
+        return {"messages": list(reversed(page)), "next_cursor": next_cursor}
+
+@app.post("/chat/{session_id}", dependencies=[Depends(require_services)])
+async def chat(session_id: int, user_message: str, request: Request):
+    started = time.perf_counter()
     # Safety Check: Input
-    user_message = moderation_service.clean_prompt_injection(user_message)
-    if not moderation_service.is_safe(user_message):
+    with stage("moderation"):
+        user_message = moderation_service.clean_prompt_injection(user_message)
+        safe_input = moderation_service.is_safe(user_message)
+    if not safe_input:
+        metrics.TURNS.labels("chat", "input_blocked").inc()
         return {"response": "[SYSTEM: Content Blocked]"}
 
-    with Session(engine) as session:
-        # 1. Get Session and Character
-        chat_session = session.get(ChatSession, session_id)
-        if not chat_session:
-            raise HTTPException(status_code=404, detail="Session not found")
-        
-        character = session.get(Character, chat_session.character_id)
-        
-        # 2. Add User Message to DB
-        msg = Message(session_id=session_id, role="user", content=user_message)
-        session.add(msg)
-        
-        # Increment interaction count
-        character.interaction_count += 1
-        session.add(character)
-        session.commit()
+    # 1. Session state and character, memories and history, fetched concurrently
+    user_msg = Message(session_id=session_id, role="user", content=user_message)
+    chat_state, character, relevant_memories, history_dicts = await gather_turn_context(session_id, user_message)
 
-        # 3. Retrieve Memory
-        relevant_memories = memory_service.get_context(str(session_id), user_message)
-        context = "\n".join(relevant_memories["long_term"])
+    # 2. Wait for an LLM slot; shed with 429/503 before anything is saved
+    slot = await admission.acquire(str(chat_state["user_id"]))
 
-        # 4. Prepare Prompt (with Current State)
+    try:
+        # 3. Prepare Prompt (with Current State) within the token budget
         current_state = {
-            "affection": chat_session.affection_score,
-            "tags": chat_session.user_tags
+            "affection": chat_state["affection"],
+            "tags": chat_state["tags"]
         }
-        system_prompt = await ai_service.format_prompt(character, context, current_state)
-        
-        # 5. Get History
-        history = session.exec(select(Message).where(Message.session_id == session_id)).all()
-        history_dicts = [{"role": m.role, "content": m.content} for m in history[-10:]]
-
-        # 6. Stream Response
-        async def event_generator():
-            full_content = ""
+        system_prompt, history_dicts, packed = await build_prompt(
+            character, current_state, relevant_memories["long_term"], history_dicts, user_message
+        )
+    except BaseException:
+        await slot.release()
+        raise
+
+    # 4. Stream Response
+    # Clients that accept text/event-stream get token/state/done events; others get plain text
+    use_sse = "text/event-stream" in request.headers.get("accept", "")
+
+    async def event_generator():
+        # Phase 5: the hidden state block is stripped mid-stream and never reaches the client
+        parser = StateStreamParser()
+        # Safety Check: Output, checked before each piece of text is sent
+        moderator = moderation_service.stream()
+        # Add User Message to DB while the reply generates; it only has to land before the reply is saved.
+        # Started with the body, so a turn the client abandoned before it began is not recorded
+        user_turn_saved = asyncio.create_task(record_user_turn(user_msg, character.id), name="record_user_turn")
+        user_turn_saved.add_done_callback(report_failure)
+        requested = time.perf_counter()
+        first = last = None
+        try:
             response = await ai_service.generate_response(system_prompt, history_dicts, user_message)
-            for chunk in response:
-                if chunk.text:
-                    full_content += chunk.text
-                    yield chunk.text
-            
-            # Phase 5: State Extraction & Sync
-            clean_content, state_update = ai_service.parse_state_updates(full_content)
-            
-            # Safety Check: Output
-            clean_content = moderation_service.filter_content(clean_content)
-
-            # Save Assistant Message to DB & Memory
-            with Session(engine) as inner_session:
-                asst_msg = Message(session_id=session_id, role="assistant", content=clean_content)
-                inner_session.add(asst_msg)
-                
-                # Update Session State
-                db_session = inner_session.get(ChatSession, session_id)
-                if state_update and db_session:
-                    db_session.affection_score = max(0, min(100, db_session.affection_score + state_update["delta"]))
-                    # Merge tags
-                    new_tags = list(set(db_session.user_tags + state_update["tags"]))
-                    db_session.user_tags = new_tags
-                
-                inner_session.commit()
-                memory_service.add_message(str(session_id), "assistant", clean_content)
-
-        return StreamingResponse(event_generator(), media_type="text/plain")
-from multimodal_service import MultiModalService
+            # Client disconnects cancel this generator, which in turn cancels the Gemini stream
+            async with aclosing(moderated_text(response, parser, moderator)) as pieces:
+                async for safe in pieces:
+                    last = time.perf_counter()
+                    if first is None:
+                        first = last
+                        metrics.record("llm_first_token", first - requested)
+                        metrics.TTFT_SECONDS.labels("chat").observe(first - started)
+                    yield sse_event("token", safe) if use_sse else safe
+        finally:
+            # The slot covers generation only; saving the turn does not hold it
+            await slot.release()
+        if first is not None:
+            metrics.STREAM_SECONDS.labels("chat").observe(last - first)
 
-multi_modal_service = MultiModalService()
+        clean_content, state_update = parser.text, parser.state
+        if moderator.blocked:
+            # Stop here: the upstream stream was closed and nothing unsafe was sent
+            clean_content, state_update = BLOCKED_MESSAGE, None
+            yield sse_event("blocked", BLOCKED_MESSAGE) if use_sse else BLOCKED_MESSAGE
+        if use_sse and state_update:
+            yield sse_event("state", json.dumps(state_update))
+
+        # Save Assistant Message to DB & Memory, after the user message it answers
+        await user_turn_saved
+        await run_in_threadpool(save_assistant_turn, session_id, clean_content, state_update)
+        metrics.TURNS.labels("chat", "blocked" if moderator.blocked else "ok").inc()
+
+        if use_sse:
+            yield sse_event("done", json.dumps({"content": clean_content}))
+
+    media_type = "text/event-stream" if use_sse else "text/plain"
+    # The background release covers a client that left before the body started
+    return StreamingResponse(event_generator(), media_type=media_type, headers=prompt_headers(packed), background=BackgroundTask(slot.release))
+
+async def voice_stream_generator(session_id: int, turn_id: str, system_prompt: str, history_dicts: List[dict], audio: PreparedAudio, started: float, slot: AdmissionSlot):
+    """Streams speech sentence by sentence while the reply is still being generated.
+
+    The producer splits the LLM stream into sentences and starts TTS for each one
+    as soon as it is complete, so synthesis of sentence k overlaps generation of
+    sentence k+1. The consumer yields the audio segments in order. Text goes to
+    the turn's side channel instead of a response header.
+    """
+    segments: asyncio.Queue = asyncio.Queue()
+    tts_slots = asyncio.Semaphore(VOICE_TTS_CONCURRENCY)
 
-@app.post("/chat/voice/{session_id}")
-async def chat_voice(session_id: int, audio_file: UploadFile = File(...)):
-    audio_bytes = await audio_file.read()
+    async def synthesize(sentence: str):
+        async with tts_slots:
+            return await multi_modal_service.text_to_speech(sentence)
+
+    async def produce():
+        parser = StateStreamParser()
+        moderator = moderation_service.stream()
+        splitter = SentenceSplitter()
+        try:
+            try:
+                response = await ai_service.generate_response(system_prompt, history_dicts, "", audio_data=audio.data, audio_mime_type=audio.mime_type)
+                first = None
+                async with aclosing(moderated_text(response, parser, moderator)) as pieces:
+                    async for safe in pieces:
+                        if first is None:
+                            first = time.perf_counter()
+                            metrics.TTFT_SECONDS.labels("voice").observe(first - started)
+                        for sentence in splitter.feed(safe):
+                            await voice_text_channel.publish(turn_id, "sentence", sentence)
+                            segments.put_nowait(asyncio.create_task(synthesize(sentence)))
+            finally:
+                await slot.release()
+            rest = None if moderator.blocked else splitter.finish()
+            if rest:
+                await voice_text_channel.publish(turn_id, "sentence", rest)
+                segments.put_nowait(asyncio.create_task(synthesize(rest)))
+
+            clean_content, state_update = parser.text, parser.state
+            if moderator.blocked:
+                clean_content, state_update = BLOCKED_MESSAGE, None
+                await voice_text_channel.publish(turn_id, "blocked", BLOCKED_MESSAGE)
+            await run_in_threadpool(save_assistant_turn, session_id, clean_content, state_update)
+            await voice_text_channel.publish(turn_id, "done", {"content": clean_content, "state": state_update})
+            metrics.TURNS.labels("voice", "blocked" if moderator.blocked else "ok").inc()
+        finally:
+            segments.put_nowait(None)
+
+    producer = asyncio.create_task(produce())
+    first_audio = None
+    try:
+        while True:
+            task = await segments.get()
+            if task is None:
+                break
+            segment = await task
+            if segment:
+                if first_audio is None:
+                    first_audio = time.perf_counter()
+                    metrics.record("first_audio", first_audio - started)
+                yield segment
+        await producer
+        if first_audio is not None:
+            metrics.STREAM_SECONDS.labels("voice").observe(time.perf_counter() - first_audio)
+    finally:
+        # Client went away or something failed: stop generating and synthesizing
+        producer.cancel()
+        while not segments.empty():
+            task = segments.get_nowait()
+            if task is not None:
+                task.cancel()
+
+@app.get("/chat/voice/text/{turn_id}")
+async def voice_text(turn_id: str):
+    """Text side channel for a streamed voice turn, as Server-Sent Events."""
+    async def event_generator():
+        while True:
+            item = await voice_text_channel.pop(turn_id, 30)
+            if item is None:
+                break
+            yield sse_event(item["event"], json.dumps(item["data"]))
+            if item["event"] == "done":
+                break
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
+@app.post("/chat/voice/{session_id}", dependencies=[Depends(require_services)])
+async def chat_voice(session_id: int, audio_file: UploadFile = File(...), stream: bool = False):
+    started = time.perf_counter()
+    # Size-checked, read from the spooled upload and compacted (mono, speech rate, silence trimmed)
+    audio = await prepare_upload(audio_file)
     
-    with Session(engine) as session:
-        chat_session = session.get(ChatSession, session_id)
-        if not chat_session:
-            raise HTTPException(status_code=404, detail="Session not found")
-        
-        character = session.get(Character, chat_session.character_id)
-        
-        # 1. Prepare context and prompt
-        relevant_memories = memory_service.get_context(str(session_id), "Voice input processing")
-        context = "\n".join(relevant_memories["long_term"])
-        current_state = {"affection": chat_session.affection_score, "tags": chat_session.user_tags}
-        system_prompt = await ai_service.format_prompt(character, context, current_state)
-        
-        # 2. Get 5 turns of history
-        history = session.exec(select(Message).where(Message.session_id == session_id)).all()
-        history_dicts = [{"role": m.role, "content": m.content} for m in history[-5:]]
-
-        # 3. Process with Gemini (Audio In -> Text Out)
-        # Note: We don't stream for voice to ensure whole response is ready for ElevenLabs
-        response = await ai_service.generate_response(system_prompt, history_dicts, "", audio_data=audio_bytes, stream=False)
-        full_content = response.text
-        
-        # 4. Clean and parse
-        clean_content, state_update = ai_service.parse_state_updates(full_content)
-        clean_content = moderation_service.filter_content(clean_content)
-
-        # 5. Save and update state
-        asst_msg = Message(session_id=session_id, role="assistant", content=clean_content)
-        session.add(asst_msg)
-        if state_update:
-            chat_session.affection_score = max(0, min(100, chat_session.affection_score + state_update["delta"]))
-            chat_session.user_tags = list(set(chat_session.user_tags + state_update["tags"]))
-        session.commit()
-        memory_service.add_message(str(session_id), "assistant", clean_content)
-
-        # 6. Convert to Speech
-        voice_audio = await multi_modal_service.text_to_speech(clean_content)
-        
-        if not voice_audio:
-             # Fallback if ElevenLabs fails
-             return {"text": clean_content, "audio": None}
-
-        # Return audio as binary stream
-        return Response(content=voice_audio, media_type="audio/mpeg", headers={
-            "X-Response-Text": clean_content # Send text in header for UI display
-        })
+    # 1. Session state and character, memories and history, fetched concurrently
+    chat_state, character, relevant_memories, history_dicts = await gather_turn_context(session_id, "Voice input processing")
+    current_state = {"affection": chat_state["affection"], "tags": chat_state["tags"]}
+
+    # 2. Pack memories and history into the token budget
+    system_prompt, history_dicts, packed = await build_prompt(
+        character, current_state, relevant_memories["long_term"], history_dicts, "[Audio Input]"
+    )
+
+    # 3. Wait for an LLM slot; shed with 429/503 when overloaded
+    slot = await admission.acquire(str(chat_state["user_id"]))
+
+    # 4. Pipelined mode: stream audio sentence by sentence, text via the side channel
+    if stream and multi_modal_service.tts_enabled:
+        turn_id = uuid.uuid4().hex
+        return StreamingResponse(
+            voice_stream_generator(session_id, turn_id, system_prompt, history_dicts, audio, started, slot),
+            media_type="audio/mpeg",
+            headers={"X-Turn-Id": turn_id, "X-Text-Url": f"/chat/voice/text/{turn_id}", **prompt_headers(packed)},
+            background=BackgroundTask(slot.release)
+        )
+
+    # 5. Process with Gemini (Audio In -> Text Out)
+    # Note: We don't stream here so the whole response is ready for one ElevenLabs call
+    async with slot:
+        with stage("llm"):
+            response = await ai_service.generate_response(system_prompt, history_dicts, "", audio_data=audio.data, stream=False, audio_mime_type=audio.mime_type)
+    full_content = response.text
+
+    # 6. Clean and parse
+    clean_content, state_update = ai_service.parse_state_updates(full_content)
+    clean_content = moderation_service.filter_content(clean_content)
+
+    # 7. Save and update state
+    await run_in_threadpool(save_assistant_turn, session_id, clean_content, state_update)
+
+    # 8. Convert to Speech
+    voice_audio = await multi_modal_service.text_to_speech(clean_content)
+    metrics.TURNS.labels("voice", "ok" if clean_content != BLOCKED_MESSAGE else "blocked").inc()
+
+    if not voice_audio:
+         # Fallback if ElevenLabs fails
+         return {"text": clean_content, "audio": None}
+
+    # Return audio as binary stream
+    return Response(content=voice_audio, media_type="audio/mpeg", headers={
+        "X-Response-Text": clean_content, # Send text in header for UI display
+        **prompt_headers(packed)
+    })
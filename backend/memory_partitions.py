@@ -0,0 +1,302 @@
+import argparse
+import os
+import re
+import threading
+import time
+import uuid
+import zlib
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from metrics import stage
+
+load_dotenv()
+
+LEGACY_COLLECTION = "oai_memory"
+LAYOUT_KEY = "memory:partitions"
+RAW_ROLES = ["user", "assistant"]
+_PARTITION_NAME = re.compile(r"^oai_memory_(\d{3})$")
+
+def partition_name(index: int, count: int) -> str:
+    """Collection holding partition `index`; a count of 0 is the old single collection."""
+    return LEGACY_COLLECTION if count == 0 else f"oai_memory_{index:03d}"
+
+def partition_for(session_id: str, count: int) -> int:
+    """Stable across processes and restarts, unlike hash()."""
+    return zlib.crc32(str(session_id).encode()) % count if count else 0
+
+class MemoryPartitions:
+    """Hash-shards long-term memory across Chroma collections by session.
+
+    Each query only searches the partition holding its session, so retrieval cost
+    follows partition size instead of total platform volume. The layout (current
+    partition count plus any earlier counts not yet rebalanced) is kept in Redis;
+    until `rebalance` has moved every vector, reads also look where the earlier
+    layouts put a session. Retention and compaction run one partition at a time.
+    """
+    def __init__(self, chroma_client, embedding_function, redis_client, count: int = 8):
+        if count < 1:
+            raise ValueError("partition count must be at least 1")
+        self.chroma_client = chroma_client
+        self.embedding_function = embedding_function
+        self.redis_client = redis_client
+        self.count = count
+        self._collections: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self.retention_days = float(os.getenv("MEMORY_RETENTION_DAYS", "0"))
+        self.max_vectors_per_session = int(os.getenv("MEMORY_MAX_VECTORS_PER_SESSION", "0"))
+        self.maintenance_interval = float(os.getenv("MEMORY_MAINTENANCE_INTERVAL", "600"))
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._next_partition = 0
+        self.previous = self._load_layout()
+
+    # Layout
+
+    def _existing_names(self) -> List[str]:
+        return [c if isinstance(c, str) else c.name for c in self.chroma_client.list_collections()]
+
+    def _load_layout(self) -> List[int]:
+        stored = self.redis_client.hgetall(LAYOUT_KEY)
+        if stored:
+            stored_count = int(stored["count"])
+            previous = [int(c) for c in stored.get("previous", "").split(",") if c]
+        else:
+            # First start with partitioning: vectors may still sit in the single collection
+            stored_count = None
+            previous = [0] if LEGACY_COLLECTION in self._existing_names() else []
+        if stored_count is not None and stored_count != self.count and stored_count not in previous:
+            previous.append(stored_count)
+        previous = [c for c in previous if c != self.count]
+        if previous:
+            print(f"Warning: memory partitions resized to {self.count}, reads also check {previous} until rebalanced")
+        self._save_layout(previous)
+        return previous
+
+    def _save_layout(self, previous: List[int]):
+        self.redis_client.hset(LAYOUT_KEY, mapping={"count": self.count, "previous": ",".join(str(c) for c in previous)})
+
+    def collection(self, name: str):
+        collection = self._collections.get(name)
+        if collection is None:
+            with self._lock:
+                collection = self._collections.get(name)
+                if collection is None:
+                    collection = self.chroma_client.get_or_create_collection(name=name, embedding_function=self.embedding_function)
+                    self._collections[name] = collection
+        return collection
+
+    def drop_all(self) -> List[str]:
+        """Deletes every memory collection, under any layout, and forgets the layout; returns their names."""
+        with self._lock:
+            names = [n for n in self._existing_names() if n == LEGACY_COLLECTION or _PARTITION_NAME.match(n)]
+            for name in names:
+                self.chroma_client.delete_collection(name)
+            self._collections.clear()
+        self.previous = []
+        self._save_layout([])
+        return names
+
+    # Routing
+
+    def for_session(self, session_id: str):
+        """The collection new vectors for this session are written to."""
+        return self.collection(partition_name(partition_for(session_id, self.count), self.count))
+
+    def read_collections(self, session_id: str) -> List[Any]:
+        """Current partition first, then wherever an unfinished resize may have left vectors."""
+        names = [partition_name(partition_for(session_id, self.count), self.count)]
+        existing = None
+        for count in self.previous:
+            name = partition_name(partition_for(session_id, count), count)
+            if name in names:
+                continue
+            if existing is None:
+                existing = set(self._existing_names())
+            if name in existing:
+                names.append(name)
+        return [self.collection(name) for name in names]
+
+    def query(self, session_id: str, query: str, n_results: int) -> List[str]:
+        with stage("chroma_query"):
+            return self._query(session_id, query, n_results)
+
+    def _query(self, session_id: str, query: str, n_results: int) -> List[str]:
+        collections = self.read_collections(session_id)
+        if len(collections) == 1:
+            results = collections[0].query(query_texts=[query], where={"session_id": session_id}, n_results=n_results)
+            return results["documents"][0] if results["documents"] else []
+        # Embed once and merge the candidates from every collection by distance
+        embedding = self.embedding_function([query])
+        candidates = []
+        for collection in collections:
+            results = collection.query(
+                query_embeddings=embedding,
+                where={"session_id": session_id},
+                n_results=n_results,
+                include=["documents", "distances"]
+            )
+            if results["documents"]:
+                candidates.extend(zip(results["distances"][0], results["documents"][0]))
+        candidates.sort(key=lambda c: c[0])
+        return [doc for _, doc in candidates[:n_results]]
+
+    def delete(self, session_id: str, where: Dict[str, Any]):
+        """Deletes matching vectors of one session wherever they currently live."""
+        for collection in self.read_collections(session_id):
+            collection.delete(where={"$and": [{"session_id": session_id}, where]})
+
+    # Rebalancing
+
+    def rebalance(self, page_size: int = 500) -> Dict[str, int]:
+        """Moves every vector to the partition the current layout assigns it.
+
+        Scans every memory collection rather than trusting the stored layout, copies
+        vectors with their stored embeddings (nothing is re-embedded) and deletes
+        them from the source. Emptied collections outside the layout are dropped.
+        """
+        token = str(time.time())
+        if not self.redis_client.set(f"{LAYOUT_KEY}:rebalance", token, nx=True, ex=3600):
+            raise RuntimeError("a rebalance is already running")
+        moved, scanned = 0, 0
+        try:
+            current = {partition_name(i, self.count) for i in range(self.count)}
+            sources = [n for n in self._existing_names() if n == LEGACY_COLLECTION or _PARTITION_NAME.match(n)]
+            for name in sources:
+                source = self.collection(name)
+                offset = 0
+                while True:
+                    page = source.get(include=["embeddings", "documents", "metadatas"], limit=page_size, offset=offset)
+                    if not page["ids"]:
+                        break
+                    scanned += len(page["ids"])
+                    targets: Dict[str, List[int]] = defaultdict(list)
+                    for i, metadata in enumerate(page["metadatas"]):
+                        target = partition_name(partition_for((metadata or {}).get("session_id", ""), self.count), self.count)
+                        if target != name:
+                            targets[target].append(i)
+                    for target, rows in targets.items():
+                        self.collection(target).upsert(
+                            ids=[page["ids"][i] for i in rows],
+                            embeddings=[page["embeddings"][i] for i in rows],
+                            documents=[page["documents"][i] for i in rows],
+                            metadatas=[page["metadatas"][i] for i in rows]
+                        )
+                    moved_ids = [page["ids"][i] for rows in targets.values() for i in rows]
+                    if moved_ids:
+                        source.delete(ids=moved_ids)
+                        moved += len(moved_ids)
+                    # Moved rows are gone, so only the ones that stayed advance the offset
+                    offset += len(page["ids"]) - len(moved_ids)
+                if name not in current and source.count() == 0:
+                    self.chroma_client.delete_collection(name)
+                    self._collections.pop(name, None)
+            self.previous = []
+            self._save_layout([])
+            return {"scanned": scanned, "moved": moved}
+        finally:
+            if self.redis_client.get(f"{LAYOUT_KEY}:rebalance") == token:
+                self.redis_client.delete(f"{LAYOUT_KEY}:rebalance")
+
+    # Retention and compaction
+
+    def maintain(self, index: int, page_size: int = 1000) -> Dict[str, Any]:
+        """Applies retention and the per-session vector cap to one partition."""
+        collection = self.collection(partition_name(index, self.count))
+        expired = 0
+        if self.retention_days > 0:
+            # Raw message vectors age out; synthesized summaries are kept
+            cutoff = int(time.time() - self.retention_days * 86400)
+            before = collection.count()
+            collection.delete(where={"$and": [{"role": {"$in": RAW_ROLES}}, {"created_at": {"$lt": cutoff}}]})
+            expired = before - collection.count()
+
+        compacted = 0
+        if self.max_vectors_per_session > 0:
+            raw: Dict[str, List[tuple]] = defaultdict(list)
+            offset = 0
+            while True:
+                page = collection.get(where={"role": {"$in": RAW_ROLES}}, include=["metadatas"], limit=page_size, offset=offset)
+                if not page["ids"]:
+                    break
+                for doc_id, metadata in zip(page["ids"], page["metadatas"]):
+                    order = (metadata.get("message_id", 0), metadata.get("created_at", 0))
+                    raw[metadata.get("session_id", "")].append((order, doc_id))
+                offset += len(page["ids"])
+            # Oldest raw vectors beyond the cap go first
+            excess = []
+            for items in raw.values():
+                if len(items) > self.max_vectors_per_session:
+                    items.sort()
+                    excess.extend(doc_id for _, doc_id in items[:len(items) - self.max_vectors_per_session])
+            for i in range(0, len(excess), page_size):
+                collection.delete(ids=excess[i:i + page_size])
+            compacted = len(excess)
+
+        return {"partition": index, "expired": expired, "compacted": compacted, "vectors": collection.count()}
+
+    def _run_maintenance(self):
+        while not self._stop.wait(self.maintenance_interval):
+            index = self._next_partition
+            self._next_partition = (index + 1) % self.count
+            lock, token = f"{LAYOUT_KEY}:maintain:{index}", uuid.uuid4().hex
+            # Several workers share the store; each partition is maintained by one of them at a time
+            if not self.redis_client.set(lock, token, nx=True, ex=max(60, int(self.maintenance_interval))):
+                continue
+            try:
+                result = self.maintain(index)
+                if result["expired"] or result["compacted"]:
+                    print(f"Memory partition {index}: expired {result['expired']}, compacted {result['compacted']}")
+            except Exception as e:
+                print(f"Warning: maintenance of memory partition {index} failed: {e}")
+            finally:
+                # A run that outlived the lock must not release another worker's
+                if self.redis_client.get(lock) == token:
+                    self.redis_client.delete(lock)
+
+    def start_maintenance(self):
+        if self.maintenance_interval <= 0 or not (self.retention_days > 0 or self.max_vectors_per_session > 0):
+            return
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run_maintenance, name="memory-maintenance", daemon=True)
+        self._thread.start()
+
+    def stop_maintenance(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(5)
+            self._thread = None
+
+    def stats(self) -> Dict[str, Any]:
+        existing = set(self._existing_names())
+        sizes = {}
+        for i in range(self.count):
+            name = partition_name(i, self.count)
+            sizes[name] = self.collection(name).count() if name in existing else 0
+        return {"count": self.count, "pending_rebalance": self.previous, "vectors": sizes}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the partitioned long-term memory store.")
+    parser.add_argument("command", choices=["stats", "rebalance", "maintain"])
+    parser.add_argument("--partition", type=int, help="maintain only this partition")
+    args = parser.parse_args()
+
+    from memory_service import MemoryService
+    memory = MemoryService()
+    try:
+        partitions = memory.partitions
+        if args.command == "stats":
+            print(partitions.stats())
+        elif args.command == "rebalance":
+            started = time.monotonic()
+            result = partitions.rebalance()
+            print(f"Rebalanced {result['moved']} of {result['scanned']} vectors in {time.monotonic() - started:.1f}s")
+        else:
+            indexes = [args.partition] if args.partition is not None else range(partitions.count)
+            for index in indexes:
+                print(partitions.maintain(index))
+    finally:
+        memory.close()
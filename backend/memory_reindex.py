@@ -0,0 +1,212 @@
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import delete, func
+from sqlmodel import Session, select
+from dotenv import load_dotenv
+
+from memory_service import MemoryService, message_doc_id, message_metadata
+from models import Message, SynthesisMark
+
+load_dotenv()
+
+_worker_embedding = None
+
+def _init_worker():
+    global _worker_embedding
+    from chromadb.utils import embedding_functions
+    _worker_embedding = embedding_functions.DefaultEmbeddingFunction()
+
+def _embed(texts: List[str]) -> List[Any]:
+    return list(_worker_embedding(texts))
+
+class MemoryReindexer:
+    """Rebuilds long-term memory vectors from the Message table.
+
+    Rows are streamed in id order through a server-side cursor, embedded in
+    batches (across a process pool when `workers` > 0) and upserted under their
+    deterministic `msg_{id}` ids, so re-runs overwrite instead of duplicating.
+    Progress is checkpointed in Redis after every batch that has been written
+    together with all batches before it, so an interrupted run resumes where it
+    stopped. Messages already folded into a synthesized summary are skipped
+    unless `include_synthesized` is set, since synthesis pruned their vectors.
+    """
+    CHECKPOINT_KEY = "memory:reindex:{job}"
+    LOCK_TTL = 600
+
+    def __init__(self, memory: Optional[MemoryService] = None, engine=None, job: str = "default",
+                 batch_size: int = 256, workers: int = 0, include_synthesized: bool = False):
+        self.memory = memory or MemoryService()
+        if engine is None:
+            from resources import create_db_engine
+            engine = create_db_engine(os.environ["DATABASE_URL"])
+        self.engine = engine
+        self.job = job
+        self.batch_size = batch_size
+        self.workers = workers
+        self.include_synthesized = include_synthesized
+        self.key = self.CHECKPOINT_KEY.format(job=job)
+        self.lock_key = f"{self.key}:lock"
+        self._thread: Optional[threading.Thread] = None
+
+    def checkpoint(self) -> Dict[str, Any]:
+        state = self.memory.redis_client.hgetall(self.key)
+        return {
+            "job": self.job,
+            "last_id": int(state.get("last_id", 0)),
+            "indexed": int(state.get("indexed", 0)),
+            "docs_per_second": float(state.get("docs_per_second", 0)),
+            "status": state.get("status", "idle"),
+            "updated_at": state.get("updated_at"),
+        }
+
+    def _save(self, **fields):
+        fields["updated_at"] = datetime.utcnow().isoformat()
+        pipe = self.memory.redis_client.pipeline()
+        pipe.hset(self.key, mapping=fields)
+        # Every checkpoint extends the run's lock
+        pipe.expire(self.lock_key, self.LOCK_TTL)
+        pipe.execute()
+
+    def reset(self, rebuild: bool = False):
+        """Forgets the checkpoint; `rebuild` also drops every memory collection and synthesis mark.
+
+        Rebuild with the API stopped: running workers hold handles to the dropped collections.
+        Refused while a run holds the lock, since its next checkpoint would write the state back.
+        """
+        if self.memory.redis_client.exists(self.lock_key):
+            raise RuntimeError(f"reindex job '{self.job}' is running; reset it once the run has stopped")
+        self.memory.redis_client.delete(self.key)
+        if rebuild:
+            self.memory.partitions.drop_all()
+            # Summaries went with the collections; let synthesis start over from the raw messages
+            with Session(self.engine) as session:
+                session.exec(delete(SynthesisMark))
+                session.commit()
+
+    def _query(self, after_id: int):
+        query = select(Message.id, Message.session_id, Message.role, Message.content, Message.created_at).where(Message.id > after_id)
+        if not self.include_synthesized:
+            mark = func.coalesce(SynthesisMark.last_message_id, 0)
+            query = query.outerjoin(SynthesisMark, SynthesisMark.session_id == Message.session_id).where(Message.id > mark)
+        return query.order_by(Message.id)
+
+    def _write(self, rows, embeddings: List[Any]):
+        groups: Dict[str, Any] = {}
+        for row, embedding in zip(rows, embeddings):
+            session_id = str(row.session_id)
+            collection = self.memory.partitions.for_session(session_id)
+            _, batch = groups.setdefault(collection.name, (collection, {"ids": [], "documents": [], "metadatas": [], "embeddings": []}))
+            batch["ids"].append(message_doc_id(row.id))
+            batch["documents"].append(row.content)
+            batch["metadatas"].append(message_metadata(session_id, row.role, row.id, row.created_at.replace(tzinfo=timezone.utc).timestamp()))
+            batch["embeddings"].append(embedding)
+        for collection, batch in groups.values():
+            collection.upsert(**batch)
+
+    def run(self, limit: Optional[int] = None, report_every: float = 5.0) -> Dict[str, Any]:
+        """Indexes everything after the checkpoint (at most `limit` rows); returns the final checkpoint."""
+        if not self.memory.redis_client.set(self.lock_key, "1", nx=True, ex=self.LOCK_TTL):
+            raise RuntimeError(f"reindex job '{self.job}' is already running")
+        state = self.checkpoint()
+        after_id, indexed = state["last_id"], state["indexed"]
+        self._save(status="running")
+        started = last_report = time.monotonic()
+        done_this_run = 0
+        pool = ProcessPoolExecutor(self.workers, initializer=_init_worker) if self.workers > 0 else None
+        # Batches being embedded, oldest first; the checkpoint only moves past fully written ones
+        in_flight: deque = deque()
+
+        def drain(keep: int):
+            nonlocal after_id, indexed, done_this_run, last_report
+            while len(in_flight) > keep:
+                rows, future = in_flight.popleft()
+                self._write(rows, future.result())
+                after_id, indexed, done_this_run = rows[-1].id, indexed + len(rows), done_this_run + len(rows)
+                rate = done_this_run / max(time.monotonic() - started, 1e-9)
+                self._save(last_id=after_id, indexed=indexed, docs_per_second=round(rate, 1))
+                if time.monotonic() - last_report >= report_every:
+                    last_report = time.monotonic()
+                    print(f"Reindexed {done_this_run} messages (up to id {after_id}), {rate:.1f} docs/sec")
+
+        try:
+            with Session(self.engine) as session:
+                query = self._query(after_id)
+                if limit is not None:
+                    query = query.limit(limit)
+                # Server-side cursor: rows arrive in batches instead of being loaded at once
+                result = session.connection().execution_options(stream_results=True, yield_per=self.batch_size).execute(query)
+                for rows in result.partitions(self.batch_size):
+                    texts = [row.content for row in rows]
+                    if pool is not None:
+                        in_flight.append((rows, pool.submit(_embed, texts)))
+                        drain(keep=self.workers * 2)
+                    else:
+                        in_flight.append((rows, _Done(self.memory.embedding_function(texts))))
+                        drain(keep=0)
+                drain(keep=0)
+            elapsed = time.monotonic() - started
+            rate = done_this_run / elapsed if elapsed > 0 else 0.0
+            self._save(status="done", docs_per_second=round(rate, 1))
+            print(f"Reindexed {done_this_run} messages in {elapsed:.1f}s ({rate:.1f} docs/sec)")
+        except BaseException:
+            self._save(status="interrupted")
+            raise
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+            self.memory.redis_client.delete(self.lock_key)
+        return self.checkpoint()
+
+    def start(self) -> bool:
+        """Runs the reindex on a background thread; False if one is already running here."""
+        if self._thread and self._thread.is_alive():
+            return False
+
+        def target():
+            try:
+                self.run()
+            except Exception as e:
+                print(f"Warning: memory reindex failed: {e}")
+
+        self._thread = threading.Thread(target=target, name="memory-reindex", daemon=True)
+        self._thread.start()
+        return True
+
+class _Done:
+    """Future-like wrapper for a batch embedded in-process."""
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild long-term memory vectors from the Message table.")
+    parser.add_argument("--job", default="default", help="checkpoint name; separate jobs resume independently")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="embedding processes (0 embeds in-process)")
+    parser.add_argument("--limit", type=int, help="stop after this many messages")
+    parser.add_argument("--include-synthesized", action="store_true", help="also index messages already summarized")
+    parser.add_argument("--reset", action="store_true", help="ignore the checkpoint and start from the first message")
+    parser.add_argument("--rebuild", action="store_true", help="drop all memory collections and synthesis marks first (e.g. after changing the embedding model)")
+    args = parser.parse_args()
+
+    reindexer = MemoryReindexer(
+        job=args.job,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        include_synthesized=args.include_synthesized or args.rebuild,
+    )
+    try:
+        if args.reset or args.rebuild:
+            reindexer.reset(rebuild=args.rebuild)
+        print(reindexer.run(limit=args.limit))
+    finally:
+        reindexer.memory.close()
@@ -2,66 +2,256 @@ import chromadb
 from chromadb.utils import embedding_functions
 import os
 import redis
+import redis.asyncio
+import asyncio
+import contextvars
 import json
-from typing import Optional, List, Dict
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Any, Tuple, Callable
 from dotenv import load_dotenv
+from embedding_cache import CachedEmbeddingFunction
+from memory_partitions import MemoryPartitions, RAW_ROLES
+from metrics import record, stage
 
 load_dotenv()
 
+def message_doc_id(message_id: int) -> str:
+    """Deterministic vector id, so re-ingesting a message overwrites instead of duplicating."""
+    return f"msg_{message_id}"
+
+def message_metadata(session_id: str, role: str, message_id: Optional[int] = None, created_at: Optional[float] = None) -> Dict[str, Any]:
+    metadata: Dict[str, Any] = {"session_id": session_id, "role": role, "created_at": int(created_at if created_at is not None else time.time())}
+    if message_id is not None:
+        # Lets synthesis find and prune the vectors it replaces
+        metadata["message_id"] = message_id
+    return metadata
+
+class MemoryIngestQueue:
+    """Write-behind buffer that embeds and stores messages in ChromaDB in batches.
+
+    A daemon thread drains the queue, flushing when a batch is full or the oldest
+    pending item has waited flush_interval seconds. Each item is written to the
+    collection `route` picks from its metadata. Failed batches are retried with
+    exponential backoff before being dropped.
+    """
+    def __init__(self, route: Callable[[Dict[str, Any]], Any], embedding_function=None, batch_size: int = 64, flush_interval: float = 0.5, max_retries: int = 3, retry_backoff: float = 0.5):
+        self.route = route
+        self.embedding_function = embedding_function
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._queue: "queue.Queue[Tuple[float, str, Dict[str, Any], str]]" = queue.Queue()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.ingested = 0
+        self.failed = 0
+        self.retries = 0
+        self.last_lag = 0.0
+        self._in_flight: List[Tuple[float, str, Dict[str, Any], str]] = []
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="memory-ingest", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Stops the worker after draining everything already queued."""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def put(self, document: str, metadata: Dict[str, Any], doc_id: str):
+        self._queue.put((time.monotonic(), document, metadata, doc_id))
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, age of the oldest pending item and lifetime counters."""
+        in_flight = self._in_flight
+        with self._queue.mutex:
+            depth = len(self._queue.queue) + len(in_flight)
+            oldest = in_flight[0][0] if in_flight else (self._queue.queue[0][0] if self._queue.queue else None)
+        return {
+            "depth": depth,
+            "oldest_pending_seconds": round(time.monotonic() - oldest, 3) if oldest is not None else 0.0,
+            "last_flush_lag_seconds": round(self.last_lag, 3),
+            "ingested": self.ingested,
+            "failed": self.failed,
+            "retries": self.retries,
+        }
+
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = self._take_batch()
+            if batch:
+                self._flush(batch)
+            self._in_flight = []
+
+    def _take_batch(self) -> List[Tuple[float, str, Dict[str, Any], str]]:
+        try:
+            first = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+        batch = self._in_flight = [first]
+        deadline = first[0] + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = 0 if self._stop.is_set() else deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch: List[Tuple[float, str, Dict[str, Any], str]]):
+        pending = batch
+        # Doc id -> vector; stays None when the collections embed for themselves
+        vectors: Optional[Dict[str, Any]] = None
+        for attempt in range(self.max_retries + 1):
+            try:
+                if vectors is None and self.embedding_function is not None:
+                    # One embedding call for the whole batch (kept across retries), whichever partitions it spans
+                    embeddings = self.embedding_function([item[1] for item in batch])
+                    vectors = {item[3]: vector for item, vector in zip(batch, embeddings)}
+                groups: Dict[str, Tuple[Any, List[Tuple[float, str, Dict[str, Any], str]]]] = {}
+                for item in pending:
+                    collection = self.route(item[2])
+                    groups.setdefault(collection.name, (collection, []))[1].append(item)
+                for collection, items in groups.values():
+                    started = time.monotonic()
+                    collection.upsert(
+                        documents=[item[1] for item in items],
+                        metadatas=[item[2] for item in items],
+                        ids=[item[3] for item in items],
+                        embeddings=[vectors[item[3]] for item in items] if vectors is not None else None
+                    )
+                    record("memory_ingest_write", time.monotonic() - started)
+                    self.ingested += len(items)
+                    # Written partitions are not retried
+                    written = {item[3] for item in items}
+                    pending = [item for item in pending if item[3] not in written]
+                self.last_lag = time.monotonic() - batch[0][0]
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self.failed += len(pending)
+                    print(f"Warning: dropping {len(pending)} memories after {attempt + 1} attempts: {e}")
+                    return
+                self.retries += 1
+                time.sleep(self.retry_backoff * (2 ** attempt))
+
 class MemoryService:
-    def __init__(self):
+    def __init__(self, redis_client: Optional[redis.Redis] = None, async_redis_client: Optional[redis.asyncio.Redis] = None,
+                 binary_redis_client: Optional[redis.Redis] = None):
         # Long-term (Vector DB)
         chroma_path = os.getenv("CHROMA_PATH", "./db/chroma")
         self.chroma_client = chromadb.PersistentClient(path=chroma_path)
-        self.embedding_function = embedding_functions.DefaultEmbeddingFunction()
-        self.collection = self.chroma_client.get_or_create_collection(
-            name="oai_memory", 
-            embedding_function=self.embedding_function
+        # Repeated and constant queries are served from the cache without model inference
+        self.embedding_function = CachedEmbeddingFunction.from_env(embedding_functions.DefaultEmbeddingFunction(), redis_client=binary_redis_client)
+        # Short-term (Redis), normally the app-wide pooled client
+        if redis_client is None:
+            redis_url = os.getenv("REDIS_URL")
+            if not redis_url:
+                 raise RuntimeError("REDIS_URL not found in environment")
+            redis_client = redis.Redis.from_url(redis_url, decode_responses=True)
+        self.redis_client = redis_client
+        self.async_redis_client = async_redis_client
+        # Chroma has no asyncio API; queries run here instead of on the event loop
+        self.query_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("CHROMA_QUERY_THREADS", "8")),
+            thread_name_prefix="chroma-query"
         )
-        # Short-term (Redis)
-        redis_url = os.getenv("REDIS_URL")
-        if not redis_url:
-             raise RuntimeError("REDIS_URL not found in environment")
-        self.redis_client = redis.Redis.from_url(redis_url, decode_responses=True)
         self.short_term_limit = 10 # Last 10 messages for immediate context
+        # Sessions are hash-sharded over several collections so a query searches one partition
+        self.partitions = MemoryPartitions(
+            self.chroma_client,
+            self.embedding_function,
+            self.redis_client,
+            count=int(os.getenv("MEMORY_PARTITIONS", "8"))
+        )
+        self.partitions.start_maintenance()
+        # Long-term writes are batched in the background so a chat turn never waits on embedding
+        self.ingest_queue = MemoryIngestQueue(
+            lambda metadata: self.partitions.for_session(metadata["session_id"]),
+            self.embedding_function,
+            batch_size=int(os.getenv("MEMORY_INGEST_BATCH_SIZE", "64")),
+            flush_interval=float(os.getenv("MEMORY_INGEST_FLUSH_INTERVAL", "0.5"))
+        )
+        self.ingest_queue.start()
 
-    def add_message(self, session_id: str, role: str, content: str):
+    def add_message(self, session_id: str, role: str, content: str, message_id: Optional[int] = None):
         """Append to short-term memory and conditionally sync to long-term."""
         message = {"role": role, "content": content, "timestamp": os.urandom(4).hex()}
         
-        # 1. Add to Redis List
+        # 1. Add to Redis List (single round trip)
         key = f"chat:{session_id}"
-        self.redis_client.rpush(key, json.dumps(message))
-        self.redis_client.ltrim(key, -self.short_term_limit, -1)
+        pipe = self.redis_client.pipeline()
+        pipe.rpush(key, json.dumps(message))
+        pipe.ltrim(key, -self.short_term_limit, -1)
+        pipe.execute()
         
-        # 2. Add to ChromaDB (Long-term)
-        self.collection.add(
-            documents=[content],
-            metadatas=[{"session_id": session_id, "role": role}],
-            ids=[f"{session_id}_{os.urandom(4).hex()}"]
-        )
+        # 2. Queue for ChromaDB (Long-term), embedded and written in batches
+        metadata = message_metadata(session_id, role, message_id)
+        doc_id = message_doc_id(message_id) if message_id is not None else f"{session_id}_{os.urandom(4).hex()}"
+        self.ingest_queue.put(content, metadata, doc_id)
 
-    def get_context(self, session_id: str, query: str) -> Dict[str, List]:
+    def get_context(self, session_id: str, query: str, n_results: int = 3) -> Dict[str, List]:
         """Retrieve both short-term context and long-term memories."""
         # 1. Short-term (last N messages)
         short_term = self.redis_client.lrange(f"chat:{session_id}", 0, -1)
         short_term = [json.loads(m) for m in short_term]
         
         # 2. Long-term (Semantic search)
-        results = self.collection.query(
-            query_texts=[query],
-            where={"session_id": session_id},
-            n_results=3
-        )
-        long_term = results["documents"][0] if results["documents"] else []
+        long_term = self.partitions.query(session_id, query, n_results)
         
         return {
             "short_term": short_term,
             "long_term": long_term
         }
 
-    def synthesize_memories(self, session_id: str):
-        """Compacts chat history into high-level summaries (The Neural Link)."""
-        # Logic for summarization via AI service would go here
-        # For now, it's a placeholder for the Memory_Synthesizer script
-        pass
+    async def get_context_async(self, session_id: str, query: str, n_results: int = 3) -> Dict[str, List]:
+        """get_context for the event loop: Redis and Chroma are queried concurrently."""
+        loop = asyncio.get_running_loop()
+        with stage("memory"):
+            # Carry the request's context into the worker so its stages are attributed to it
+            context = contextvars.copy_context()
+            long_term = loop.run_in_executor(self.query_executor, context.run, self.partitions.query, session_id, query, n_results)
+            if self.async_redis_client is not None:
+                short_term = await self.async_redis_client.lrange(f"chat:{session_id}", 0, -1)
+            else:
+                short_term = await loop.run_in_executor(self.query_executor, self.redis_client.lrange, f"chat:{session_id}", 0, -1)
+            return {
+                "short_term": [json.loads(m) for m in short_term],
+                "long_term": await long_term
+            }
+
+    def close(self):
+        """Flushes pending long-term writes."""
+        self.ingest_queue.stop()
+        self.partitions.stop_maintenance()
+        self.query_executor.shutdown(wait=False)
+
+    def synthesize_memories(self, session_id: str, summary: str, message_ids: List[int], prune: bool = True):
+        """Stores a synthesized summary (The Neural Link) and drops the raw vectors of the summarized messages."""
+        first_message_id, last_message_id = min(message_ids), max(message_ids)
+        self.partitions.for_session(session_id).upsert(
+            documents=[summary],
+            metadatas=[{
+                "session_id": session_id,
+                "type": "synthesis",
+                "first_message_id": first_message_id,
+                "last_message_id": last_message_id
+            }],
+            ids=[f"synth_{session_id}_{last_message_id}"]
+        )
+        if prune:
+            # Only per-message vectors carry a role; the summary itself is kept
+            self.partitions.delete(session_id, {"$and": [
+                {"role": {"$in": RAW_ROLES}},
+                # Only the summarized messages: others below the mark may not be ingested or covered yet
+                {"message_id": {"$in": list(message_ids)}}
+            ]})
@@ -1,45 +1,191 @@
 import asyncio
+import argparse
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from admission import BACKGROUND_USER, AdmissionController
 from ai_service import AIService
 from memory_service import MemoryService
-import json
+from models import Message, SynthesisMark
+
+SYNTHESIS_INSTRUCTIONS = """
+Analyze the following conversation history and extract EXACTLY three critical pieces of information for long-term memory:
+1. User's stated goal or preference.
+2. Key emotional markers or relationship status.
+3. Specific facts mentioned (names, locations, promises).
+
+Format as a JSON object.
+"""
 
 class MemorySynthesizer:
-    def __init__(self):
-        self.ai = AIService()
-        self.memory = MemoryService()
-
-    async def summarize_session(self, session_id: str):
-        """Fetches short-term memory and generates a core identity summary."""
-        context = self.memory.get_context(session_id, "summary")
-        short_term = context["short_term"]
-        
-        if not short_term:
-            return
-            
-        history_str = "\n".join([f"{m['role']}: {m['content']}" for m in short_term])
-        
-        prompt = f"""
-        Analyze the following conversation history and extract EXACTLY three critical pieces of information for long-term memory:
-        1. User's stated goal or preference.
-        2. Key emotional markers or relationship status.
-        3. Specific facts mentioned (names, locations, promises).
-        
-        Format as a JSON object.
-        
-        History:
-        {history_str}
-        """
-        
-        summary_json = await self.ai.generate_response(prompt, stream=False)
-        
-        # Save the synthesized summary back to long-term memory
-        self.memory.collection.add(
-            documents=[summary_json],
-            metadatas=[{"session_id": session_id, "type": "synthesis"}],
-            ids=[f"synth_{session_id}_{hash(summary_json)}"]
+    """Incrementally folds new chat messages into synthesized long-term memories.
+
+    Each session has a high-water mark (SynthesisMark.last_message_id). A cycle
+    picks up to `batch_sessions` sessions with at least `min_new_messages` settled
+    messages past their mark, summarizes only those messages, stores the summary
+    in Chroma, prunes the vectors of exactly those messages and advances the mark.
+    At most `concurrency` sessions are summarized at once, and a Redis lock keeps
+    cycles from overlapping across workers. With an admission controller, each
+    summary takes a background LLM slot, so synthesis counts against the same
+    caps as chat turns and yields to them.
+    """
+    LOCK_KEY = "synthesis:lock"
+
+    def __init__(self, ai: Optional[AIService] = None, memory: Optional[MemoryService] = None, engine=None,
+                 admission: Optional[AdmissionController] = None):
+        self.ai = ai or AIService()
+        self.admission = admission
+        self.memory = memory or MemoryService()
+        if engine is None:
+            from resources import create_db_engine
+            engine = create_db_engine(os.environ["DATABASE_URL"])
+        self.engine = engine
+        self.interval = float(os.getenv("MEMORY_SYNTHESIS_INTERVAL", "300"))
+        self.batch_sessions = int(os.getenv("MEMORY_SYNTHESIS_BATCH_SESSIONS", "50"))
+        self.min_new_messages = int(os.getenv("MEMORY_SYNTHESIS_MIN_MESSAGES", "20"))
+        self.max_messages = int(os.getenv("MEMORY_SYNTHESIS_MAX_MESSAGES", "200"))
+        self.concurrency = int(os.getenv("MEMORY_SYNTHESIS_CONCURRENCY", "4"))
+        # Messages younger than this may still be waiting in the ingest queue
+        self.settle = timedelta(seconds=float(os.getenv("MEMORY_SYNTHESIS_SETTLE_SECONDS", "60")))
+        self.prune = os.getenv("MEMORY_SYNTHESIS_PRUNE", "true").lower() == "true"
+        self._task = None
+
+    def find_sessions(self) -> List[Dict[str, int]]:
+        """Sessions with enough settled messages past their high-water mark."""
+        cutoff = datetime.utcnow() - self.settle
+        mark = func.coalesce(SynthesisMark.last_message_id, 0)
+        query = (
+            select(Message.session_id, mark, func.count(Message.id))
+            .outerjoin(SynthesisMark, SynthesisMark.session_id == Message.session_id)
+            .where(Message.id > mark, Message.created_at < cutoff)
+            .group_by(Message.session_id, mark)
+            .having(func.count(Message.id) >= self.min_new_messages)
+            .limit(self.batch_sessions)
         )
-        print(f"Synthesized memory for session {session_id}")
+        with Session(self.engine) as session:
+            rows = session.exec(query).all()
+        return [{"session_id": sid, "after_id": after_id, "pending": count} for sid, after_id, count in rows]
+
+    def load_messages(self, session_id: int, after_id: int) -> List[Message]:
+        cutoff = datetime.utcnow() - self.settle
+        with Session(self.engine) as session:
+            return list(session.exec(
+                select(Message)
+                .where(Message.session_id == session_id, Message.id > after_id, Message.created_at < cutoff)
+                .order_by(Message.id)
+                .limit(self.max_messages)
+            ).all())
+
+    def advance_mark(self, session_id: int, last_message_id: int):
+        with Session(self.engine) as session:
+            mark = session.get(SynthesisMark, session_id) or SynthesisMark(session_id=session_id)
+            mark.last_message_id = max(mark.last_message_id, last_message_id)
+            mark.updated_at = datetime.utcnow()
+            session.add(mark)
+            session.commit()
+
+    async def summarize_session(self, session_id: int, after_id: int = 0) -> bool:
+        """Summarizes messages after `after_id` and stores the result; returns whether anything was written."""
+        loop = asyncio.get_running_loop()
+        messages = await loop.run_in_executor(None, self.load_messages, session_id, after_id)
+        if not messages:
+            return False
+
+        history_str = "\n".join([f"{m.role}: {m.content}" for m in messages])
+        try:
+            response = await self.generate(f"History:\n{history_str}")
+        except HTTPException:
+            # Shed while chat is busy; the mark has not moved, so the next cycle retries
+            return False
+        summary = response.text.strip()
+        if not summary:
+            return False
+
+        first_id, last_id = messages[0].id, messages[-1].id
+        message_ids = [m.id for m in messages]
+        await loop.run_in_executor(None, self.memory.synthesize_memories, str(session_id), summary, message_ids, self.prune)
+        await loop.run_in_executor(None, self.advance_mark, session_id, last_id)
+        print(f"Synthesized memory for session {session_id} (messages {first_id}-{last_id})")
+        return True
+
+    async def generate(self, prompt: str):
+        if self.admission is None:
+            return await self.ai.generate_response(SYNTHESIS_INSTRUCTIONS, [], prompt, stream=False)
+        async with await self.admission.acquire(BACKGROUND_USER):
+            return await self.ai.generate_response(SYNTHESIS_INSTRUCTIONS, [], prompt, stream=False)
+
+    async def _redis(self, command: str, *args, **kwargs):
+        """Runs a lock command on the async Redis client, or on a thread with the blocking one (CLI)."""
+        if self.memory.async_redis_client is not None:
+            return await getattr(self.memory.async_redis_client, command)(*args, **kwargs)
+        return await asyncio.to_thread(getattr(self.memory.redis_client, command), *args, **kwargs)
+
+    async def run_cycle(self) -> Dict[str, Any]:
+        """One bounded-concurrency pass over the sessions that need synthesis."""
+        loop = asyncio.get_running_loop()
+        token = uuid.uuid4().hex
+        if not await self._redis("set", self.LOCK_KEY, token, nx=True, ex=max(60, int(self.interval))):
+            return {"skipped": True}
+        try:
+            sessions = await loop.run_in_executor(None, self.find_sessions)
+            slots = asyncio.Semaphore(self.concurrency)
+
+            async def one(candidate):
+                async with slots:
+                    try:
+                        return await self.summarize_session(candidate["session_id"], candidate["after_id"])
+                    except Exception as e:
+                        print(f"Warning: synthesis failed for session {candidate['session_id']}: {e}")
+                        return False
+
+            results = await asyncio.gather(*(one(c) for c in sessions))
+            return {"skipped": False, "sessions": len(sessions), "synthesized": sum(results)}
+        finally:
+            if await self._redis("get", self.LOCK_KEY) == token:
+                await self._redis("delete", self.LOCK_KEY)
+
+    async def run(self):
+        while True:
+            try:
+                await self.run_cycle()
+            except Exception as e:
+                print(f"Warning: synthesis cycle failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synthesize long-term memories from new chat messages.")
+    parser.add_argument("--once", action="store_true", help="run a single cycle and exit")
+    parser.add_argument("--session", type=int, help="summarize one session past its high-water mark")
+    args = parser.parse_args()
+
     synthesizer = MemorySynthesizer()
-    # Example usage: asyncio.run(synthesizer.summarize_session("test_session"))
+
+    async def main():
+        if args.session is not None:
+            with Session(synthesizer.engine) as session:
+                mark = session.get(SynthesisMark, args.session)
+            await synthesizer.summarize_session(args.session, mark.last_message_id if mark else 0)
+        elif args.once:
+            print(await synthesizer.run_cycle())
+        else:
+            await synthesizer.run()
+
+    try:
+        asyncio.run(main())
+    finally:
+        synthesizer.memory.close()
@@ -0,0 +1,95 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+# Latency buckets from sub-millisecond cache hits up to slow generations
+_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STAGE_SECONDS = Histogram("oai_stage_seconds", "Time spent in one pipeline stage", ["stage"], buckets=_BUCKETS)
+TTFT_SECONDS = Histogram("oai_time_to_first_token_seconds", "Request start to first streamed text", ["route"], buckets=_BUCKETS)
+STREAM_SECONDS = Histogram("oai_stream_duration_seconds", "First to last streamed text", ["route"], buckets=_BUCKETS)
+TURNS = Counter("oai_turns_total", "Completed chat turns", ["route", "outcome"])
+ADMISSION_WAIT_SECONDS = Histogram("oai_admission_wait_seconds", "Time an admitted turn queued for an LLM slot", buckets=_BUCKETS)
+ADMISSIONS = Counter("oai_admissions_total", "LLM slot requests by outcome", ["outcome"])
+
+# Stages of the current request, for its Server-Timing header
+_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("server_timings", default=None)
+
+def record(name: str, seconds: float):
+    STAGE_SECONDS.labels(name).observe(seconds)
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+@contextmanager
+def stage(name: str):
+    """Times a block into the stage histogram and the request's Server-Timing."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+class _CallbackGauges:
+    """Gauges read at scrape time, so queue depths cost nothing on the request path."""
+    def __init__(self):
+        self.callbacks: Dict[str, Tuple[str, Callable[[], float]]] = {}
+
+    def collect(self):
+        for name, (documentation, callback) in self.callbacks.items():
+            try:
+                value = callback()
+            except Exception:
+                continue
+            if value is None:
+                continue
+            family = GaugeMetricFamily(name, documentation)
+            family.add_metric([], float(value))
+            yield family
+
+_gauges = _CallbackGauges()
+REGISTRY.register(_gauges)
+
+def gauge(name: str, documentation: str, callback: Callable[[], float]):
+    _gauges.callbacks[name] = (documentation, callback)
+
+def render() -> Tuple[bytes, str]:
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+class ServerTimingMiddleware:
+    """Adds a Server-Timing header listing the stages recorded for the request.
+
+    The header goes out with the response start, so a streamed response reports
+    the stages before its first byte and everything else reports all of them
+    plus `app`, the total handler time.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings: List[Tuple[str, float]] = []
+        token = _timings.set(timings)
+        start = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start" and timings:
+                entries = [(name, seconds) for name, seconds in timings]
+                headers = list(message.get("headers", []))
+                if any(k.lower() == b"content-length" for k, _ in headers):
+                    entries.append(("app", time.perf_counter() - start))
+                value = ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in entries)
+                headers.append((b"server-timing", value.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _timings.reset(token)
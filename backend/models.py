@@ -1,7 +1,7 @@
 from datetime import datetime
 from typing import List, Optional
 from sqlmodel import Field, Relationship, SQLModel
-from sqlalchemy import JSON, Column
+from sqlalchemy import JSON, Column, Index
 
 class User(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -25,6 +25,26 @@ class Character(SQLModel, table=True):
     owner_id: int = Field(foreign_key="user.id")
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+class CharacterSummary(SQLModel):
+    """Lightweight projection used by catalog listings."""
+    id: int
+    name: str
+    title: Optional[str] = None
+    description: str
+    image_url: Optional[str] = None
+    banner_url: Optional[str] = None
+    interaction_count: int = 0
+
+class CharacterUpdate(SQLModel):
+    name: Optional[str] = None
+    title: Optional[str] = None
+    description: Optional[str] = None
+    traits: Optional[List[str]] = None
+    system_prompt: Optional[str] = None
+    few_shot_examples: Optional[List[dict]] = None
+    image_url: Optional[str] = None
+    banner_url: Optional[str] = None
+
 class ChatSession(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id")
@@ -35,8 +55,22 @@ class ChatSession(SQLModel, table=True):
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class Message(SQLModel, table=True):
+    # History is always read per session, newest first
+    __table_args__ = (Index("ix_message_session_id_created_at", "session_id", "created_at", "id"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     session_id: int = Field(foreign_key="chatsession.id")
     role: str # 'user' or 'assistant'
     content: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class CounterFlush(SQLModel, table=True):
+    """Batches of buffered counters already applied, so a retried flush is never counted twice."""
+    batch_id: str = Field(primary_key=True)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class SynthesisMark(SQLModel, table=True):
+    """High-water mark of messages already folded into synthesized memories, per session."""
+    session_id: int = Field(primary_key=True, foreign_key="chatsession.id")
+    last_message_id: int = Field(default=0)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
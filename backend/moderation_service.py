@@ -1,19 +1,139 @@
 import re
-from typing import List
+import os
+import json
+import time
+from typing import List, Optional
+
+BLOCKED_MESSAGE = "[CONTENT BLOCKED: Safety Violation]"
+INJECTION_MESSAGE = "[POTENTIAL PROMPT INJECTION DETECTED]"
+
+# Professional-grade blacklist (placeholders for real safety keywords)
+DEFAULT_BLOCKED_TERMS = ["hate", "violence", "explicit", "illegal", "harmful", "dangerous", "toxic"]
+# Simple patterns like 'Ignore all previous instructions'
+DEFAULT_INJECTION_PHRASES = [
+    "ignore all previous",
+    "forget your instructions",
+    "you are now a",
+    "transcribe this",
+    "stop your persona"
+]
+
+def _alternation(items: List[str]) -> str:
+    # Longest first so overlapping terms prefer the longer match; (?!) never matches
+    escaped = [re.escape(i) for i in sorted(set(items), key=len, reverse=True) if i]
+    return "|".join(escaped) if escaped else "(?!)"
+
+class ModerationRules:
+    """A rule set compiled once into single-pass matchers; replaced wholesale on reload."""
+    def __init__(self, blocked_terms: List[str], injection_phrases: List[str]):
+        self.blocked_terms = list(blocked_terms)
+        self.injection_phrases = list(injection_phrases)
+        # Case-insensitive matcher for streamed chunks, and a case-sensitive one over
+        # pre-lowercased text for whole replies (about twice as fast in CPython's re)
+        self.blocked = re.compile(rf"\b(?:{_alternation(self.blocked_terms)})\b", re.IGNORECASE)
+        self.blocked_lower = re.compile(rf"\b(?:{_alternation([t.lower() for t in self.blocked_terms])})\b")
+        # A handful of literal phrases: str.__contains__ on one lowercased copy beats a regex alternation
+        self.injection_lower = tuple(p.lower() for p in self.injection_phrases if p)
+        # Longest possible blocked match, and every prefix of a term: a stream only has
+        # to hold back a tail that could still grow into a match
+        self.max_blocked_len = max((len(t) for t in self.blocked_terms), default=0)
+        self.blocked_prefixes = frozenset(t.lower()[:i] for t in self.blocked_terms for i in range(1, len(t) + 1))
+
+class StreamModerator:
+    """Checks streamed output chunk by chunk, before it leaves the server.
+
+    Only a tail that is a prefix of some blocked term is held back, since a match
+    could still straddle the next chunk boundary; everything before it has been
+    fully checked and is released.
+    """
+    def __init__(self, rules: ModerationRules):
+        self.rules = rules
+        self.blocked = False
+        self._pending = ""
+        self._context = ""
+
+    def feed(self, text: str) -> str:
+        """Returns the text that is safe to forward; sets `blocked` on a violation."""
+        if self.blocked:
+            return ""
+        self._pending += text
+        if self._scan(final=False):
+            return ""
+        return self._release(len(self._pending) - self._hold_len())
+
+    def finish(self) -> str:
+        if self.blocked:
+            return ""
+        if self._scan(final=True):
+            return ""
+        return self._release(len(self._pending))
+
+    def _scan(self, final: bool) -> bool:
+        buf = self._context + self._pending
+        # Start after the context character so \b still sees what came before
+        for match in self.rules.blocked.finditer(buf, len(self._context)):
+            if match.end() == len(buf) and not final:
+                # A word boundary at the end of the buffer is not confirmed yet
+                break
+            self.blocked = True
+            self._pending = ""
+            return True
+        return False
+
+    def _hold_len(self) -> int:
+        tail = self._pending[-self.rules.max_blocked_len:].lower() if self.rules.max_blocked_len else ""
+        for k in range(len(tail), 0, -1):
+            if tail[-k:] in self.rules.blocked_prefixes:
+                return k
+        return 0
+
+    def _release(self, n: int) -> str:
+        out = self._pending[:n]
+        if out:
+            self._context = out[-1]
+            self._pending = self._pending[n:]
+        return out
 
 class ModerationService:
-    def __init__(self):
-        # Professional-grade blacklist patterns
-        self.blacklist_patterns = [
-            r"\b(hate|violence|explicit|illegal)\b", # Placeholders for real safety keywords
-            r"\b(harmful|dangerous|toxic)\b"
-        ]
-        
+    def __init__(self, rules_path: Optional[str] = None, reload_interval: float = 5.0):
+        # Optional JSON file {"blocked_terms": [...], "injection_phrases": [...]}, re-read when it changes
+        self.rules_path = rules_path or os.getenv("MODERATION_RULES_PATH")
+        self.reload_interval = reload_interval
+        self._rules_mtime: Optional[float] = None
+        self._next_reload_check = 0.0
+        self.rules = ModerationRules(DEFAULT_BLOCKED_TERMS, DEFAULT_INJECTION_PHRASES)
+        self.reload_if_changed(force=True)
+
+    def reload_if_changed(self, force: bool = False) -> bool:
+        """Recompiles the rule set if the rules file changed; cheap enough to call per request."""
+        if not self.rules_path:
+            return False
+        now = time.monotonic()
+        if not force and now < self._next_reload_check:
+            return False
+        self._next_reload_check = now + self.reload_interval
+        try:
+            mtime = os.path.getmtime(self.rules_path)
+            if not force and mtime == self._rules_mtime:
+                return False
+            with open(self.rules_path) as f:
+                data = json.load(f)
+            rules = ModerationRules(
+                data.get("blocked_terms", DEFAULT_BLOCKED_TERMS),
+                data.get("injection_phrases", DEFAULT_INJECTION_PHRASES)
+            )
+        except (OSError, ValueError) as e:
+            print(f"Warning: could not load moderation rules from {self.rules_path}: {e}")
+            return False
+        self.rules = rules
+        self._rules_mtime = mtime
+        return True
+
     def filter_content(self, text: str) -> str:
         """Checks if content should be blocked or sanitized."""
-        for pattern in self.blacklist_patterns:
-            if re.search(pattern, text, re.IGNORECASE):
-                return "[CONTENT BLOCKED: Safety Violation]"
+        self.reload_if_changed()
+        if self.rules.blocked_lower.search(text.lower()):
+            return BLOCKED_MESSAGE
         return text
 
     def is_safe(self, text: str) -> bool:
@@ -22,15 +142,13 @@ class ModerationService:
 
     def clean_prompt_injection(self, text: str) -> str:
         """Strips common injection patterns."""
-        # Simple patterns like 'Ignore all previous instructions'
-        patterns = [
-            "ignore all previous",
-            "forget your instructions",
-            "you are now a",
-            "transcribe this",
-            "stop your persona"
-        ]
-        for p in patterns:
-            if p in text.lower():
-                return "[POTENTIAL PROMPT INJECTION DETECTED]"
+        self.reload_if_changed()
+        lowered = text.lower()
+        if any(p in lowered for p in self.rules.injection_lower):
+            return INJECTION_MESSAGE
         return text
+
+    def stream(self) -> StreamModerator:
+        """Incremental checker for one streamed response."""
+        self.reload_if_changed()
+        return StreamModerator(self.rules)
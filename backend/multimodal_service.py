@@ -1,21 +1,88 @@
 import os
+import re
+import json
 import httpx
+from typing import List, Optional, Dict, Any
 from dotenv import load_dotenv
+from metrics import stage
 
 load_dotenv()
 
 ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
+ELEVENLABS_BASE_URL = os.getenv("ELEVENLABS_BASE_URL", "https://api.elevenlabs.io") # Point at a local fake for benchmarks
 VOICE_ID = os.getenv("ELEVENLABS_VOICE_ID", "21m00Tcm4TlvDq8ikWAM") # Default voice
 
+# Sentence ends: Latin punctuation followed by whitespace, CJK punctuation, or a newline
+_SENTENCE_END = re.compile(r"(?:[.!?…]+[\"')\]]*\s+|[。！？]+[」』）]*|\n+)")
+
+class SentenceSplitter:
+    """Cuts a streamed reply into sentences as soon as each one is complete.
+
+    Sentences shorter than min_chars are merged with the next one so very short
+    fragments do not each pay a TTS round trip.
+    """
+    def __init__(self, min_chars: int = 20):
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        self._buffer += text
+        sentences: List[str] = []
+        start = 0
+        for match in _SENTENCE_END.finditer(self._buffer):
+            if match.end() - start >= self.min_chars:
+                sentence = self._buffer[start:match.end()].strip()
+                if sentence:
+                    sentences.append(sentence)
+                start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def finish(self) -> Optional[str]:
+        rest, self._buffer = self._buffer.strip(), ""
+        return rest or None
+
+class TurnTextChannel:
+    """Side channel carrying the text of a streamed voice turn, shared across workers via Redis.
+
+    Takes asyncio Redis clients. Readers block in BLPOP, so they use
+    `listen_client` (a separate pool) when given one.
+    """
+    def __init__(self, redis_client, listen_client=None, ttl: int = 300):
+        self.redis_client = redis_client
+        self.listen_client = listen_client or redis_client
+        self.ttl = ttl
+
+    def _key(self, turn_id: str) -> str:
+        return f"voice_text:{turn_id}"
+
+    async def publish(self, turn_id: str, event: str, data: Any):
+        key = self._key(turn_id)
+        pipe = self.redis_client.pipeline()
+        pipe.rpush(key, json.dumps({"event": event, "data": data}))
+        pipe.expire(key, self.ttl)
+        await pipe.execute()
+
+    async def pop(self, turn_id: str, timeout: int) -> Optional[Dict[str, Any]]:
+        """Waits up to `timeout` seconds for the next event."""
+        item = await self.listen_client.blpop(self._key(turn_id), timeout=timeout)
+        return json.loads(item[1]) if item else None
+
 class MultiModalService:
-    def __init__(self):
-        self.elevenlabs_url = f"https://api.elevenlabs.io/v1/text-to-speech/{VOICE_ID}"
+    def __init__(self, http_client: Optional[httpx.AsyncClient] = None):
+        # Shared keep-alive client from the app resources; set on startup
+        self.http_client = http_client
+        self.elevenlabs_url = f"{ELEVENLABS_BASE_URL}/v1/text-to-speech/{VOICE_ID}"
         self.headers = {
             "Accept": "audio/mpeg",
             "Content-Type": "application/json",
             "xi-api-key": ELEVENLABS_API_KEY or ""
         }
 
+    @property
+    def tts_enabled(self) -> bool:
+        return bool(ELEVENLABS_API_KEY)
+
     async def text_to_speech(self, text: str):
         if not ELEVENLABS_API_KEY:
             return None
@@ -29,11 +96,15 @@ class MultiModalService:
             }
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(self.elevenlabs_url, json=data, headers=self.headers)
-            if response.status_code == 200:
-                return response.content
-            return None
+        with stage("tts"):
+            if self.http_client is not None:
+                response = await self.http_client.post(self.elevenlabs_url, json=data, headers=self.headers)
+            else:
+                async with httpx.AsyncClient() as client:
+                    response = await client.post(self.elevenlabs_url, json=data, headers=self.headers)
+        if response.status_code == 200:
+            return response.content
+        return None
 
     async def generate_visual_context(self, chat_summary: str):
         """
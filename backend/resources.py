@@ -0,0 +1,208 @@
+import os
+from typing import Any, Dict, Optional
+
+import httpx
+import redis
+import redis.asyncio
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import create_engine
+from dotenv import load_dotenv
+
+load_dotenv()
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+def _pool_share(for_async: bool) -> Dict[str, int]:
+    """One engine's part of the per-worker budget of DB_POOL_SIZE + DB_MAX_OVERFLOW connections.
+
+    The sync and async engines split the budget (DB_ASYNC_POOL_SHARE goes to the
+    async one), so a worker never opens more than the two settings add up to
+    (each engine keeps at least one pooled connection).
+    """
+    size, overflow = _env_int("DB_POOL_SIZE", 10), _env_int("DB_MAX_OVERFLOW", 20)
+    share = float(os.getenv("DB_ASYNC_POOL_SHARE", "0.5"))
+    async_size, async_overflow = max(1, round(size * share)), round(overflow * share)
+    if for_async:
+        return {"pool_size": async_size, "max_overflow": async_overflow}
+    return {"pool_size": max(1, size - async_size), "max_overflow": max(0, overflow - async_overflow)}
+
+def create_db_engine(database_url: str):
+    """SQLAlchemy engine with an explicitly sized, health-checked pool."""
+    if database_url.startswith("sqlite"):
+        # SQLite has no server-side connections worth pooling
+        return create_engine(database_url)
+    return create_engine(
+        database_url,
+        **_pool_share(for_async=False),
+        pool_timeout=_env_int("DB_POOL_TIMEOUT", 30),
+        # Drop connections the server or a proxy may have closed while idle
+        pool_recycle=_env_int("DB_POOL_RECYCLE", 1800),
+        pool_pre_ping=True,
+    )
+
+def async_database_url(database_url: str) -> str:
+    """Same database through its asyncio driver: asyncpg for Postgres, aiosqlite for SQLite."""
+    scheme, sep, rest = database_url.partition("://")
+    base = scheme.split("+")[0]
+    if base in ("postgres", "postgresql"):
+        # asyncpg spells libpq's sslmode as ssl
+        return "postgresql+asyncpg" + sep + rest.replace("sslmode=", "ssl=")
+    if base == "sqlite":
+        return "sqlite+aiosqlite" + sep + rest
+    return database_url
+
+def create_async_db_engine(database_url: str):
+    """Async counterpart of create_db_engine for request-path queries."""
+    url = async_database_url(database_url)
+    if url.startswith("sqlite"):
+        return create_async_engine(url)
+    return create_async_engine(
+        url,
+        **_pool_share(for_async=True),
+        pool_timeout=_env_int("DB_POOL_TIMEOUT", 30),
+        pool_recycle=_env_int("DB_POOL_RECYCLE", 1800),
+        pool_pre_ping=True,
+    )
+
+def create_http_client() -> httpx.AsyncClient:
+    """Keep-alive HTTP client for outbound APIs; HTTP/2 when the h2 package is installed."""
+    http2 = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            print("Warning: h2 not installed, outbound HTTP falls back to HTTP/1.1")
+            http2 = False
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=_env_int("HTTP_MAX_CONNECTIONS", 100),
+            max_keepalive_connections=_env_int("HTTP_MAX_KEEPALIVE", 20),
+            keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30")),
+        ),
+        timeout=httpx.Timeout(float(os.getenv("HTTP_TIMEOUT", "30")), connect=5.0),
+    )
+
+class Resources:
+    """Process-wide connection pools shared by every service.
+
+    The database engines and Redis pools are created eagerly; the HTTP client is
+    opened on app startup and closed on shutdown together with the others. The
+    request path uses the asyncio engine and Redis client, background workers
+    and thread-pool code the blocking ones. The two database engines share one
+    budget: a worker holds at most DB_POOL_SIZE + DB_MAX_OVERFLOW Postgres
+    connections (30 by default), so size Postgres' max_connections for that
+    times the number of workers, plus CLI jobs that build their own engine.
+    """
+    def __init__(self, database_url: str, redis_url: Optional[str] = None):
+        self.engine = create_db_engine(database_url)
+        self.async_engine = create_async_db_engine(database_url)
+        self.redis_pool: Optional[redis.ConnectionPool] = None
+        self.redis_client: Optional[redis.Redis] = None
+        self.async_redis_pool: Optional[redis.asyncio.ConnectionPool] = None
+        self.async_redis_client: Optional[redis.asyncio.Redis] = None
+        self.async_redis_listen_pool: Optional[redis.asyncio.ConnectionPool] = None
+        self.async_redis_listen_client: Optional[redis.asyncio.Redis] = None
+        self.redis_binary_pool: Optional[redis.ConnectionPool] = None
+        self.redis_binary_client: Optional[redis.Redis] = None
+        if redis_url:
+            self.redis_pool = redis.ConnectionPool.from_url(
+                redis_url,
+                max_connections=_env_int("REDIS_MAX_CONNECTIONS", 50),
+                health_check_interval=30,
+                decode_responses=True,
+            )
+            self.redis_client = redis.Redis(connection_pool=self.redis_pool)
+            # Raw bytes (cached embedding vectors) need a client that does not decode responses
+            self.redis_binary_pool = redis.ConnectionPool.from_url(
+                redis_url,
+                max_connections=_env_int("REDIS_BINARY_CONNECTIONS", 10),
+                health_check_interval=30,
+            )
+            self.redis_binary_client = redis.Redis(connection_pool=self.redis_binary_pool)
+            self.async_redis_pool = redis.asyncio.ConnectionPool.from_url(
+                redis_url,
+                max_connections=_env_int("REDIS_MAX_CONNECTIONS", 50),
+                health_check_interval=30,
+                decode_responses=True,
+            )
+            self.async_redis_client = redis.asyncio.Redis(connection_pool=self.async_redis_pool)
+            # Long-polling reads (BLPOP) hold a connection while they wait; they get their own pool,
+            # which queues callers when full, so they cannot use up the request path's connections
+            self.async_redis_listen_pool = redis.asyncio.BlockingConnectionPool.from_url(
+                redis_url,
+                max_connections=_env_int("REDIS_LISTEN_CONNECTIONS", 100),
+                timeout=_env_int("REDIS_LISTEN_POOL_TIMEOUT", 30),
+                health_check_interval=30,
+                decode_responses=True,
+            )
+            self.async_redis_listen_client = redis.asyncio.Redis(connection_pool=self.async_redis_listen_pool)
+        self.http_client: Optional[httpx.AsyncClient] = None
+
+    async def start(self):
+        if self.http_client is None:
+            self.http_client = create_http_client()
+
+    async def close(self):
+        if self.http_client is not None:
+            await self.http_client.aclose()
+            self.http_client = None
+        if self.redis_pool is not None:
+            self.redis_pool.disconnect()
+        if self.redis_binary_pool is not None:
+            self.redis_binary_pool.disconnect()
+        if self.async_redis_pool is not None:
+            await self.async_redis_pool.disconnect()
+        if self.async_redis_listen_pool is not None:
+            await self.async_redis_listen_pool.disconnect()
+        self.engine.dispose()
+        await self.async_engine.dispose()
+
+    def stats(self) -> Dict[str, Any]:
+        """Current pool usage for the database, Redis and HTTP clients."""
+        db = self._pool_stats(self.engine.pool)
+        db["async"] = self._pool_stats(self.async_engine.pool)
+
+        cache: Dict[str, Any] = {}
+        if self.redis_pool is not None:
+            cache = {
+                "max_connections": self.redis_pool.max_connections,
+                "created": getattr(self.redis_pool, "_created_connections", None),
+                "in_use": len(getattr(self.redis_pool, "_in_use_connections", ())),
+                "available": len(getattr(self.redis_pool, "_available_connections", ())),
+            }
+        if self.redis_binary_pool is not None:
+            cache["binary"] = {
+                "max_connections": self.redis_binary_pool.max_connections,
+                "in_use": len(getattr(self.redis_binary_pool, "_in_use_connections", ())),
+            }
+        if self.async_redis_pool is not None:
+            cache["async"] = {
+                "in_use": len(getattr(self.async_redis_pool, "_in_use_connections", ())),
+                "available": len(getattr(self.async_redis_pool, "_available_connections", ())),
+            }
+        if self.async_redis_listen_pool is not None:
+            cache["listen"] = {
+                "max_connections": self.async_redis_listen_pool.max_connections,
+                "in_use": len(getattr(self.async_redis_listen_pool, "_in_use_connections", ())),
+            }
+
+        http: Dict[str, Any] = {"open": self.http_client is not None}
+        # httpx does not expose pool state publicly; read it from the httpcore pool if present
+        connection_pool = getattr(getattr(self.http_client, "_transport", None), "_pool", None)
+        connections = getattr(connection_pool, "connections", None)
+        if connections is not None:
+            http["connections"] = len(connections)
+            http["idle"] = sum(1 for c in connections if c.is_idle())
+
+        return {"database": db, "redis": cache, "http": http}
+
+    @staticmethod
+    def _pool_stats(pool) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {"class": type(pool).__name__}
+        for name in ("size", "checkedin", "checkedout", "overflow"):
+            method = getattr(pool, name, None)
+            if callable(method):
+                stats[name] = method()
+        return stats
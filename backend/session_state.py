@@ -0,0 +1,180 @@
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import bindparam, update
+from sqlmodel import Session
+
+from models import ChatSession
+
+# Adds the delta to affection clamped to 0..100, unions the tags, bumps the
+# version and marks the session dirty, all in one atomic step.
+# KEYS: state hash, tags set, dirty hash. ARGV: delta, session id, ttl, tags...
+_APPLY_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return false end
+local affection = tonumber(redis.call('HGET', KEYS[1], 'affection')) + tonumber(ARGV[1])
+if affection < 0 then affection = 0 elseif affection > 100 then affection = 100 end
+redis.call('HSET', KEYS[1], 'affection', affection)
+for i = 4, #ARGV do redis.call('SADD', KEYS[2], ARGV[i]) end
+local version = redis.call('HINCRBY', KEYS[1], 'version', 1)
+redis.call('HSET', KEYS[3], ARGV[2], version)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return affection
+"""
+
+# Populates a cold session only if no other worker did it first.
+# KEYS: state hash, tags set. ARGV: ttl, character_id, user_id, affection, tags...
+_LOAD_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then return 0 end
+redis.call('HSET', KEYS[1], 'character_id', ARGV[2], 'user_id', ARGV[3], 'affection', ARGV[4], 'version', 0)
+for i = 5, #ARGV do redis.call('SADD', KEYS[2], ARGV[i]) end
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return 1
+"""
+
+# Clears the dirty mark only if nothing changed since the state was read.
+_CLEAR_DIRTY_SCRIPT = """
+if redis.call('HGET', KEYS[1], ARGV[1]) == ARGV[2] then return redis.call('HDEL', KEYS[1], ARGV[1]) end
+return 0
+"""
+
+class SessionStateCache:
+    """Hot copy of ChatSession affection/tags in Redis, written back to the table in batches.
+
+    Reads for a cached session never touch the database. Updates are applied
+    atomically in Redis (clamp-and-add for affection, set union for tags), so
+    concurrent turns cannot lose each other's changes. Changed sessions are kept
+    in a dirty hash with their version and flushed with one bulk UPDATE; a mark
+    is only cleared if the version is unchanged, so nothing is dropped.
+    """
+    DIRTY_KEY = "session_state:dirty"
+
+    def __init__(self, redis_client, engine, ttl: int = 86400, flush_interval: float = 5.0, async_redis_client=None):
+        self.redis_client = redis_client
+        # Lets the request path read hot state without blocking the event loop
+        self.async_redis_client = async_redis_client
+        self.engine = engine
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._apply = redis_client.register_script(_APPLY_SCRIPT)
+        self._load = redis_client.register_script(_LOAD_SCRIPT)
+        self._clear_dirty = redis_client.register_script(_CLEAR_DIRTY_SCRIPT)
+        self._task = None
+
+    def _keys(self, session_id: int):
+        return f"session_state:{session_id}", f"session_state:{session_id}:tags"
+
+    def _read(self, session_id: int) -> Optional[Dict[str, Any]]:
+        state_key, tags_key = self._keys(session_id)
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.hgetall(state_key)
+        pipe.smembers(tags_key)
+        fields, tags = pipe.execute()
+        return self._decode(fields, tags)
+
+    async def _read_async(self, session_id: int) -> Optional[Dict[str, Any]]:
+        state_key, tags_key = self._keys(session_id)
+        pipe = self.async_redis_client.pipeline(transaction=False)
+        pipe.hgetall(state_key)
+        pipe.smembers(tags_key)
+        fields, tags = await pipe.execute()
+        return self._decode(fields, tags)
+
+    @staticmethod
+    def _decode(fields: Dict[str, str], tags) -> Optional[Dict[str, Any]]:
+        if not fields:
+            return None
+        return {
+            "character_id": int(fields["character_id"]),
+            "user_id": int(fields["user_id"]),
+            "affection": int(fields["affection"]),
+            "tags": sorted(tags),
+            "version": fields.get("version", "0"),
+        }
+
+    def _populate(self, session_id: int) -> bool:
+        with Session(self.engine) as session:
+            chat_session = session.get(ChatSession, session_id)
+            if not chat_session:
+                return False
+            args = [self.ttl, chat_session.character_id, chat_session.user_id, chat_session.affection_score]
+            self._load(keys=list(self._keys(session_id)), args=args + [t for t in chat_session.user_tags if t])
+        return True
+
+    def get(self, session_id: int) -> Optional[Dict[str, Any]]:
+        """Session state ({character_id, user_id, affection, tags}); None if the session does not exist."""
+        state = self._read(session_id)
+        if state is None:
+            if not self._populate(session_id):
+                return None
+            state = self._read(session_id)
+        return state
+
+    async def get_async(self, session_id: int) -> Optional[Dict[str, Any]]:
+        """Like get; a cache miss is loaded from the table on a worker thread."""
+        if self.async_redis_client is None:
+            return await asyncio.to_thread(self.get, session_id)
+        state = await self._read_async(session_id)
+        if state is None:
+            state = await asyncio.to_thread(self.get, session_id)
+        return state
+
+    def apply(self, session_id: int, delta: int, tags: List[str]) -> Optional[int]:
+        """Atomically applies a state update; returns the new affection score."""
+        keys = list(self._keys(session_id)) + [self.DIRTY_KEY]
+        args = [delta, session_id, self.ttl] + [t for t in tags if t]
+        affection = self._apply(keys=keys, args=args)
+        if affection is None:
+            # Evicted or never loaded: warm it from the table and retry once
+            if not self._populate(session_id):
+                return None
+            affection = self._apply(keys=keys, args=args)
+        return int(affection) if affection is not None else None
+
+    def flush(self) -> int:
+        """Writes dirty sessions back to ChatSession in one bulk UPDATE; returns how many."""
+        dirty = self.redis_client.hgetall(self.DIRTY_KEY)
+        if not dirty:
+            return 0
+        states = {}
+        for session_id in dirty:
+            state = self._read(int(session_id))
+            if state is not None:
+                states[int(session_id)] = state
+        if states:
+            table = ChatSession.__table__
+            stmt = (
+                update(table)
+                .where(table.c.id == bindparam("session_id"))
+                .values(affection_score=bindparam("affection"), user_tags=bindparam("tags"))
+            )
+            params = [{"session_id": sid, "affection": s["affection"], "tags": s["tags"]} for sid, s in sorted(states.items())]
+            with Session(self.engine) as session:
+                session.connection().execute(stmt, params)
+                session.commit()
+        for session_id in dirty:
+            state = states.get(int(session_id))
+            # Expired entries have nothing left to write; changed ones stay dirty for the next flush
+            version = state["version"] if state else dirty[session_id]
+            self._clear_dirty(keys=[self.DIRTY_KEY], args=[session_id, version])
+        return len(states)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await loop.run_in_executor(None, self.flush)
+            except Exception as e:
+                print(f"Warning: session state flush failed: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await asyncio.get_running_loop().run_in_executor(None, self.flush)
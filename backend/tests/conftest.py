@@ -0,0 +1,69 @@
+"""Tests run from backend/ against local stand-ins (see benchmarks/fakes.py); they need fakeredis[lua].
+
+The environment is set here, before any app module reads it at import time;
+the app itself is only imported by the `app_server` fixture.
+"""
+import os
+import shutil
+import socket
+import sys
+import tempfile
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+WORKDIR = tempfile.mkdtemp(prefix="backend-tests-")
+TTS_PORT = _free_port()
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(WORKDIR, 'test.db')}",
+    "CHROMA_PATH": os.path.join(WORKDIR, "chroma"),
+    "REDIS_URL": "redis://fakeredis/0",
+    "MEMORY_SYNTHESIS_ENABLED": "false",
+    "ELEVENLABS_API_KEY": "test",
+    "ELEVENLABS_BASE_URL": f"http://127.0.0.1:{TTS_PORT}",
+    # grpc core logs connection teardown of the in-process test server at INFO
+    "GRPC_VERBOSITY": "ERROR",
+})
+
+@pytest.fixture(scope="session")
+def tts_server():
+    from benchmarks.fake_tts import FakeTTSServer
+    server = FakeTTSServer(TTS_PORT, base_latency=0.05, per_char_latency=0.004).start()
+    yield server
+    server.stop()
+
+@pytest.fixture(scope="session")
+def app_server(tts_server):
+    """The app served by uvicorn over real HTTP, with Gemini, Redis and embeddings faked."""
+    from benchmarks import fakes
+    fakes.use_fakeredis()
+    fakes.use_hash_embeddings()
+    from benchmarks.chat_load import AppServer
+    import main
+    main.ai_service = fakes.FakeAIService()
+    server = AppServer(main.app, _free_port()).start()
+    yield server
+    server.stop()
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+@pytest.fixture
+def client(app_server):
+    with httpx.Client(base_url=f"http://127.0.0.1:{app_server.port}", timeout=30) as client:
+        yield client
+
+@pytest.fixture
+def session_id(client):
+    name = os.urandom(4).hex()
+    user = client.post("/auth/register", json={"username": name, "email": f"{name}@example.com", "hashed_password": "x"}).json()
+    character = client.post("/characters/", json={
+        "name": "Tester", "description": "A patient listener.", "traits": ["calm"],
+        "system_prompt": "Stay in character.", "owner_id": user["user_id"]
+    }).json()
+    return client.post("/sessions/", json={"user_id": user["user_id"], "character_id": character["id"]}).json()["id"]
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from admission import BACKGROUND_USER, AdmissionController
+
+def run(coro):
+    return asyncio.run(coro)
+
+def test_other_user_admitted_while_busy_user_is_queued():
+    async def scenario():
+        admission = AdmissionController(max_concurrent=4, per_user=2, queue_timeout=0.2)
+        held = [await admission.acquire("a"), await admission.acquire("a")]
+        queued = asyncio.create_task(admission.acquire("a"))
+        await asyncio.sleep(0)
+        # "a" is at its cap with a turn queued; "b" must still get one of the free slots
+        slot = await admission.acquire("b")
+        assert admission.active == 3 and admission.queued == 1
+        await slot.release()
+        await held[0].release()
+        await (await queued).release()
+        await held[1].release()
+        assert admission.stats() == {"active": 0, "queued": 0, "users_waiting": 0}
+    run(scenario())
+
+def test_queued_users_are_served_round_robin():
+    async def scenario():
+        admission = AdmissionController(max_concurrent=1, per_user=1, max_queued_per_user=4, queue_timeout=2)
+        order = []
+
+        async def turn(user):
+            slot = await admission.acquire(user)
+            order.append(user)
+            await asyncio.sleep(0.01)
+            await slot.release()
+
+        first = await admission.acquire("x")
+        tasks = [asyncio.create_task(turn("a")) for _ in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(turn("b")))
+        await asyncio.sleep(0)
+        await first.release()
+        await asyncio.gather(*tasks)
+        assert order[:2] == ["a", "b"]
+    run(scenario())
+
+def test_background_waits_for_user_turns():
+    async def scenario():
+        admission = AdmissionController(max_concurrent=1, per_user=2, queue_timeout=2)
+        first = await admission.acquire("x")
+        background = asyncio.create_task(admission.acquire(BACKGROUND_USER))
+        await asyncio.sleep(0)
+        user = asyncio.create_task(admission.acquire("a"))
+        await asyncio.sleep(0)
+        await first.release()
+        slot = await user
+        assert not background.done()
+        await slot.release()
+        await (await background).release()
+    run(scenario())
+
+def test_sheds_user_over_limit_and_on_timeout():
+    async def scenario():
+        admission = AdmissionController(max_concurrent=4, per_user=1, max_queued_per_user=1, queue_timeout=0.05)
+        slot = await admission.acquire("u")
+        waiting = asyncio.create_task(admission.acquire("u"))
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as over:
+            await admission.acquire("u")
+        assert over.value.status_code == 429
+        with pytest.raises(HTTPException) as timeout:
+            await waiting
+        assert timeout.value.status_code == 503
+        await slot.release()
+        assert admission.stats()["active"] == 0
+    run(scenario())
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        admission = AdmissionController(max_concurrent=1, per_user=1, queue_timeout=1)
+        slot = await admission.acquire("a")
+        waiting = asyncio.create_task(admission.acquire("b"))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert admission.queued == 0
+        await slot.release()
+        assert admission.active == 0
+    run(scenario())
@@ -0,0 +1,85 @@
+import asyncio
+
+import grpc
+import pytest
+from google.api_core import grpc_helpers_async
+
+from benchmarks.fakes import FakeAIService, FakeChunk, FakeGenerativeModel
+
+def service(**kwargs) -> FakeAIService:
+    return FakeAIService(FakeGenerativeModel(first_token_latency=0, **kwargs))
+
+async def first_chunks(ai, response, count: int):
+    chunks = ai.stream_text(response)
+    received = [await anext(chunks) for _ in range(count)]
+    await chunks.aclose()
+    return received
+
+def test_stream_text_yields_every_chunk():
+    async def scenario():
+        ai = service(tokens=["Hello ", "", "there."])
+        response = await ai.generate_response("system", [], "hi")
+        return [text async for text in ai.stream_text(response)], response
+
+    texts, response = asyncio.run(scenario())
+    assert texts == ["Hello ", "there."]
+    assert not response.cancelled and response.finished_at is not None
+
+def test_stream_text_reraises_upstream_errors():
+    class Broken:
+        async def __aiter__(self):
+            yield FakeChunk("partial")
+            raise RuntimeError("stream reset")
+
+    async def scenario():
+        return [text async for text in service().stream_text(Broken())]
+
+    with pytest.raises(RuntimeError, match="stream reset"):
+        asyncio.run(scenario())
+
+def test_closing_early_cancels_the_pending_read():
+    async def scenario():
+        ai = service(tokens_per_second=20)
+        response = await ai.generate_response("system", [], "hi")
+        assert len(await first_chunks(ai, response, 2)) == 2
+        return response
+
+    response = asyncio.run(scenario())
+    assert response.cancelled and response.streamed < len(response.tokens)
+
+def test_closing_early_cancels_a_grpc_stream():
+    async def scenario():
+        server_cancelled = asyncio.Event()
+
+        async def stream(request, context):
+            try:
+                for i in range(1000):
+                    yield f"chunk {i} ".encode()
+                    await asyncio.sleep(0.01)
+            except asyncio.CancelledError:
+                server_cancelled.set()
+                raise
+
+        server = grpc.aio.server()
+        server.add_generic_rpc_handlers([grpc.method_handlers_generic_handler(
+            "test.Generate", {"Stream": grpc.unary_stream_rpc_method_handler(stream)})])
+        port = server.add_insecure_port("127.0.0.1:0")
+        await server.start()
+        try:
+            async with grpc.aio.insecure_channel(f"127.0.0.1:{port}") as channel:
+                call = channel.unary_stream("/test.Generate/Stream")(b"")
+                # The SDK streams through api_core's wrapper around the grpc.aio call
+                wrapped = grpc_helpers_async._WrappedUnaryStreamCall().with_call(call)
+
+                class Response:
+                    async def __aiter__(self):
+                        async for message in wrapped:
+                            yield FakeChunk(message.decode())
+
+                assert await first_chunks(service(), Response(), 3) == ["chunk 0 ", "chunk 1 ", "chunk 2 "]
+                await asyncio.wait_for(server_cancelled.wait(), 5)
+                return call.cancelled()
+        finally:
+            await server.stop(None)
+
+    assert asyncio.run(scenario())
@@ -0,0 +1,21 @@
+import io
+import struct
+
+import pytest
+from fastapi import HTTPException
+
+from audio_upload import preprocess_wav
+
+def wav_header(channels: int = 1, rate: int = 16000, width: int = 2) -> bytes:
+    """A 44-byte PCM WAV header with an empty data chunk."""
+    fmt = struct.pack("<HHIIHH", 1, channels, rate, rate * channels * width, channels * width, width * 8)
+    return b"RIFF" + struct.pack("<I", 36) + b"WAVE" + b"fmt " + struct.pack("<I", 16) + fmt + b"data" + struct.pack("<I", 0)
+
+def test_zero_frame_rate_is_rejected():
+    with pytest.raises(HTTPException) as error:
+        preprocess_wav(io.BytesIO(wav_header(rate=0)))
+    assert error.value.status_code == 400
+
+def test_voice_route_answers_400_for_a_bad_header(client, session_id):
+    response = client.post(f"/chat/voice/{session_id}", files={"audio_file": ("voice.wav", wav_header(rate=0), "audio/wav")})
+    assert response.status_code == 400 and response.json()["detail"] == "Invalid WAV header"
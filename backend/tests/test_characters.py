@@ -0,0 +1,9 @@
+def test_summary_view_matches_the_declared_schema(client, session_id):
+    schema = client.get("/openapi.json").json()
+    listing = schema["paths"]["/characters/"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+    declared = {option["items"]["$ref"].rsplit("/", 1)[-1] for option in listing["anyOf"]}
+    assert declared == {"Character", "CharacterSummary"}
+
+    summary_fields = set(schema["components"]["schemas"]["CharacterSummary"]["properties"])
+    items = client.get("/characters/", params={"view": "summary"}).json()
+    assert items and all(set(item) == summary_fields for item in items)
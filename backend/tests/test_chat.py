@@ -0,0 +1,21 @@
+def messages(client, session_id):
+    return [(m["role"], m["content"]) for m in client.get(f"/sessions/{session_id}/messages").json()["messages"]]
+
+def test_chat_saves_user_then_assistant(client, session_id):
+    import main
+    from benchmarks.fakes import FakeGenerativeModel
+    main.ai_service.model = FakeGenerativeModel(first_token_latency=0.01, tokens=["Hello ", "there.", "[[STATE: affection_delta=+1, new_tags=[] ]]"])
+    response = client.post(f"/chat/{session_id}", params={"user_message": "hi"})
+    assert response.status_code == 200 and response.text == "Hello there."
+    assert messages(client, session_id) == [("user", "hi"), ("assistant", "Hello there.")]
+
+def test_failed_prompt_records_nothing(client, session_id, monkeypatch):
+    import main
+    from fastapi import HTTPException
+
+    async def broken(*args, **kwargs):
+        raise HTTPException(status_code=500, detail="prompt failed")
+    monkeypatch.setattr(main, "build_prompt", broken)
+    assert client.post(f"/chat/{session_id}", params={"user_message": "hi"}).status_code == 500
+    assert messages(client, session_id) == []
+    assert client.get("/admission").json()["active"] == 0
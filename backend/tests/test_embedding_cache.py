@@ -0,0 +1,46 @@
+import threading
+
+import fakeredis
+import numpy as np
+
+from benchmarks.fakes import HashEmbeddingFunction
+from embedding_cache import CachedEmbeddingFunction, DiskVectorStore
+
+def test_redis_tier_uses_the_client_it_is_given(monkeypatch):
+    monkeypatch.setenv("EMBEDDING_CACHE_SHARED", "redis")
+    monkeypatch.delenv("EMBEDDING_CACHE_REDIS_URL", raising=False)
+    client = fakeredis.FakeRedis()
+    first = CachedEmbeddingFunction.from_env(HashEmbeddingFunction(), redis_client=client)
+    assert first.shared.client is client
+    vector = first(["hello there"])[0]
+
+    # Another worker with a cold in-process cache finds the vector in Redis
+    second = CachedEmbeddingFunction.from_env(HashEmbeddingFunction(), redis_client=client)
+    assert np.array_equal(second(["hello there"])[0], vector)
+    assert second.stats()["shared_hits"] == 1 and second.stats()["misses"] == 0
+
+def test_app_binary_redis_client_returns_bytes(app_server):
+    import main
+    client = main.resources.redis_binary_client
+    client.set("emb:test", np.ones(4, dtype=np.float32).tobytes())
+    assert np.array_equal(np.frombuffer(client.get("emb:test"), dtype=np.float32), np.ones(4, dtype=np.float32))
+
+def test_disk_tier_survives_threads_writing_the_same_key(tmp_path):
+    store = DiskVectorStore(str(tmp_path))
+    values = [bytes([i]) * 1536 for i in range(8)]
+    errors = []
+
+    def write(value):
+        try:
+            for _ in range(200):
+                store.set_many({"ab" * 32: value})
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(value,)) for value in values]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert store.get_many(["ab" * 32])[0] in values
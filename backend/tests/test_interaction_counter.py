@@ -0,0 +1,21 @@
+import asyncio
+
+import redis
+
+from interaction_counter import InteractionCounter
+
+class DownRedis:
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise redis.ConnectionError("Connection refused")
+        return fail
+
+def test_stop_survives_a_failed_final_flush(capsys):
+    async def scenario():
+        counter = InteractionCounter(DownRedis(), engine=None, flush_interval=60)
+        counter.start()
+        await counter.stop()
+        return counter
+
+    assert asyncio.run(scenario())._task is None
+    assert "final interaction counter flush failed" in capsys.readouterr().out
@@ -0,0 +1,34 @@
+from memory_service import MemoryIngestQueue
+
+class Collection:
+    def __init__(self, fail_first: int = 0):
+        self.name = "oai_memory_000"
+        self.fail_first = fail_first
+        self.upserts = []
+
+    def upsert(self, **kwargs):
+        if self.fail_first:
+            self.fail_first -= 1
+            raise ConnectionError("chroma unavailable")
+        self.upserts.append(kwargs)
+
+def batch(*texts):
+    return [(0.0, text, {"session_id": "1"}, f"msg_{i}") for i, text in enumerate(texts)]
+
+def test_flush_without_embedding_function_lets_chroma_embed():
+    collection = Collection()
+    MemoryIngestQueue(lambda metadata: collection)._flush(batch("a", "b"))
+    assert collection.upserts[0]["embeddings"] is None and collection.upserts[0]["ids"] == ["msg_0", "msg_1"]
+
+def test_flush_embeds_once_across_retries():
+    collection = Collection(fail_first=1)
+    calls = []
+
+    def embed(texts):
+        calls.append(list(texts))
+        return [[float(len(t))] for t in texts]
+
+    ingest = MemoryIngestQueue(lambda metadata: collection, embedding_function=embed, retry_backoff=0)
+    ingest._flush(batch("a", "bb"))
+    assert calls == [["a", "bb"]] and ingest.retries == 1
+    assert collection.upserts[0]["embeddings"] == [[1.0], [2.0]]
@@ -0,0 +1,39 @@
+import chromadb
+import fakeredis
+import pytest
+
+from benchmarks.fakes import HashEmbeddingFunction
+from memory_partitions import LAYOUT_KEY, LEGACY_COLLECTION, MemoryPartitions
+
+@pytest.fixture
+def partitions(tmp_path):
+    client = chromadb.PersistentClient(path=str(tmp_path / "chroma"))
+    return MemoryPartitions(client, HashEmbeddingFunction(), fakeredis.FakeRedis(decode_responses=True), count=4)
+
+def test_drop_all_removes_only_memory_collections(partitions):
+    session_partition = partitions.for_session("a").name
+    partitions.for_session("a").add(ids=["a1"], documents=["hello"], metadatas=[{"session_id": "a"}])
+    partitions.collection(LEGACY_COLLECTION)
+    partitions.chroma_client.get_or_create_collection("unrelated")
+    partitions.previous = [0]
+
+    dropped = partitions.drop_all()
+    assert sorted(dropped) == [LEGACY_COLLECTION, session_partition]
+    assert [c if isinstance(c, str) else c.name for c in partitions.chroma_client.list_collections()] == ["unrelated"]
+    assert partitions.previous == [] and partitions.redis_client.hget(LAYOUT_KEY, "previous") == ""
+    # Handles are recreated on the next use
+    assert partitions.for_session("a").count() == 0
+
+def test_maintenance_keeps_a_lock_taken_over_by_another_worker(partitions):
+    lock = f"{LAYOUT_KEY}:maintain:0"
+    partitions.maintenance_interval = 0.01
+
+    def slow_maintain(index):
+        # The run outlived its lock and another worker took the partition
+        partitions.redis_client.set(lock, "other worker")
+        partitions._stop.set()
+        return {"partition": index, "expired": 0, "compacted": 0, "vectors": 0}
+
+    partitions.maintain = slow_maintain
+    partitions._run_maintenance()
+    assert partitions.redis_client.get(lock) == "other worker"
@@ -0,0 +1,14 @@
+def test_reset_refused_while_a_run_holds_the_lock(client):
+    import main
+    # Waits for startup, which builds the reindexer
+    client.get("/memory/reindex").raise_for_status()
+    reindexer = main.memory_reindexer
+    redis_client = reindexer.memory.redis_client
+    redis_client.hset(reindexer.key, mapping={"last_id": 42, "indexed": 42, "status": "running"})
+    redis_client.set(reindexer.lock_key, "1")
+    try:
+        response = client.post("/memory/reindex", params={"reset": "true"})
+        assert response.status_code == 409
+        assert client.get("/memory/reindex").json()["last_id"] == 42
+    finally:
+        redis_client.delete(reindexer.lock_key, reindexer.key)
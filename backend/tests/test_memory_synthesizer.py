@@ -0,0 +1,44 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import fakeredis
+
+from memory_synthesizer import MemorySynthesizer
+
+class BlockingRedis:
+    """The sync client must stay off the event loop whenever an async one is available."""
+    def __getattr__(self, name):
+        raise AssertionError(f"blocking Redis call {name}() in run_cycle")
+
+def test_cycle_lock_uses_the_async_client():
+    async def scenario():
+        memory = SimpleNamespace(redis_client=BlockingRedis(), async_redis_client=fakeredis.FakeAsyncRedis(decode_responses=True))
+        synthesizer = MemorySynthesizer(ai=object(), memory=memory, engine=object())
+        synthesizer.find_sessions = lambda: []
+        first = await synthesizer.run_cycle()
+        released = await memory.async_redis_client.get(MemorySynthesizer.LOCK_KEY) is None
+        await memory.async_redis_client.set(MemorySynthesizer.LOCK_KEY, "other worker")
+        second = await synthesizer.run_cycle()
+        return first, released, second
+
+    first, released, second = asyncio.run(scenario())
+    assert first == {"skipped": False, "sessions": 0, "synthesized": 0} and released
+    assert second == {"skipped": True}
+
+def test_synthesis_prunes_only_the_summarized_messages(client):
+    import main
+    # Waits for startup, which builds the memory service
+    client.get("/memory/reindex").raise_for_status()
+    session_id = f"synth-{os.urandom(4).hex()}"
+    partitions = main.memory_service.partitions
+    partitions.for_session(session_id).upsert(
+        ids=[f"msg_{session_id}_{i}" for i in range(1, 6)],
+        documents=[f"message {i}" for i in range(1, 6)],
+        metadatas=[{"session_id": session_id, "role": "user", "message_id": i} for i in range(1, 6)],
+    )
+    # Message 3 was not ingested yet when its neighbours were summarized
+    main.memory_service.synthesize_memories(session_id, "summary", [1, 2, 4])
+    left = partitions.for_session(session_id).get(where={"session_id": session_id}, include=["metadatas"])
+    assert sorted(m.get("message_id", 0) for m in left["metadatas"] if "role" in m) == [3, 5]
+    assert f"synth_{session_id}_4" in left["ids"]
@@ -0,0 +1,10 @@
+from resources import _pool_share
+
+def test_engines_split_the_connection_budget(monkeypatch):
+    monkeypatch.setenv("DB_POOL_SIZE", "10")
+    monkeypatch.setenv("DB_MAX_OVERFLOW", "20")
+    monkeypatch.setenv("DB_ASYNC_POOL_SHARE", "0.7")
+    sync, async_ = _pool_share(for_async=False), _pool_share(for_async=True)
+    assert async_ == {"pool_size": 7, "max_overflow": 14}
+    assert sync["pool_size"] + async_["pool_size"] == 10
+    assert sync["max_overflow"] + async_["max_overflow"] == 20
@@ -0,0 +1,11 @@
+import os
+import subprocess
+import sys
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_import_without_redis_url_names_the_setting():
+    env = {k: v for k, v in os.environ.items() if k != "REDIS_URL"}
+    result = subprocess.run([sys.executable, "-c", "import main"], cwd=BACKEND, env=env, capture_output=True, text=True, timeout=120)
+    assert result.returncode != 0
+    assert "RuntimeError: REDIS_URL not found in environment" in result.stderr
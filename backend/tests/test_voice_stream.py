@@ -0,0 +1,94 @@
+import json
+import time
+
+from benchmarks.chat_load import silent_wav
+from benchmarks.fake_tts import fake_audio
+from benchmarks.fakes import FakeGenerativeModel
+from moderation_service import BLOCKED_MESSAGE
+from multimodal_service import SentenceSplitter
+
+LONG = "This first sentence is rather long, so speaking it takes the fake voice a while."
+SHORT = "Short second one here!"
+LAST = "And a third to finish."
+STATE = "[[STATE: affection_delta=+2, new_tags=[voice] ]]"
+
+def words(text: str):
+    return [word + " " for word in text.split()]
+
+def use_reply(tokens, tokens_per_second: float = 20.0) -> FakeGenerativeModel:
+    import main
+    model = FakeGenerativeModel(first_token_latency=0.05, tokens_per_second=tokens_per_second, tokens=tokens)
+    main.ai_service.model = model
+    return model
+
+def post_voice(client, session_id: int, stream: bool = True):
+    return client.stream("POST", f"/chat/voice/{session_id}", params={"stream": str(stream).lower()},
+                         files={"audio_file": ("voice.wav", silent_wav(0.2), "audio/wav")})
+
+def side_channel(client, response):
+    events = []
+    with client.stream("GET", response.headers["x-text-url"]) as text:
+        event = None
+        for line in text.iter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                events.append((event, json.loads(line[len("data: "):])))
+    return events
+
+def test_sentence_splitter_boundaries():
+    splitter = SentenceSplitter(min_chars=20)
+    assert splitter.feed("Hi. ") == []
+    # Too-short sentences are merged with the next one
+    assert splitter.feed("How are you doing today? I am") == ["Hi. How are you doing today?"]
+    assert splitter.feed(' fine, "really fine." Next') == ['I am fine, "really fine."']
+    assert splitter.finish() == "Next"
+    assert splitter.finish() is None
+
+    cjk = SentenceSplitter(min_chars=2)
+    assert cjk.feed("你好吗？我很好。还有") == ["你好吗？", "我很好。"]
+    assert cjk.feed("一行\n下一行") == ["还有一行"]
+    assert cjk.finish() == "下一行"
+
+def test_segments_arrive_in_order_while_tts_overlaps_generation(client, session_id, tts_server):
+    model = use_reply(words(LONG) + words(SHORT) + words(LAST) + [STATE])
+    tts_server.app.state.log.clear()
+    with post_voice(client, session_id) as response:
+        assert response.status_code == 200
+        body = response.read()
+
+    # The short second sentence is synthesized faster, but the segments still come back in order
+    assert body == fake_audio(LONG) + fake_audio(SHORT) + fake_audio(LAST)
+    log = {text: (started, finished) for text, started, finished in tts_server.app.state.log}
+    assert log[SHORT][1] < log[LONG][1]
+    # Speech for the first sentence started while the reply was still being generated
+    assert log[LONG][0] < model.responses[-1].finished_at - 0.2
+
+def test_side_channel_carries_sentences_and_done(client, session_id):
+    use_reply(words(LONG) + words(SHORT) + words(LAST) + [STATE], tokens_per_second=200.0)
+    with post_voice(client, session_id) as response:
+        response.read()
+    events = side_channel(client, response)
+    assert events[:-1] == [("sentence", LONG), ("sentence", SHORT), ("sentence", LAST)]
+    assert events[-1] == ("done", {"content": f"{LONG} {SHORT} {LAST}", "state": {"delta": 2, "tags": ["voice"]}})
+
+def test_blocked_reply_stops_audio_and_reports_blocked(client, session_id):
+    model = use_reply(words(LONG) + words("Then something toxic appears in the reply.") + words(LAST), tokens_per_second=200.0)
+    with post_voice(client, session_id) as response:
+        body = response.read()
+    assert body == fake_audio(LONG)
+    events = side_channel(client, response)
+    assert events == [("sentence", LONG), ("blocked", BLOCKED_MESSAGE), ("done", {"content": BLOCKED_MESSAGE, "state": None})]
+    assert model.responses[-1].cancelled
+
+def test_client_disconnect_cancels_generation_and_tts(client, session_id, tts_server):
+    model = use_reply(words(LONG) * 40, tokens_per_second=50.0)
+    with post_voice(client, session_id) as response:
+        assert next(response.iter_bytes())
+    time.sleep(0.5)
+    reply = model.responses[-1]
+    assert reply.cancelled and reply.streamed < len(reply.tokens)
+    requests = tts_server.app.state.requests
+    time.sleep(0.5)
+    assert tts_server.app.state.requests == requests
+    assert client.get("/admission").json()["active"] == 0
@@ -48,9 +48,10 @@ function ChatContent() {
         const fetchChar = async () => {
             try {
                 const apiUrl = process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000";
-                const res = await fetch(`${apiUrl}/characters/`);
+                let res = await fetch(`${apiUrl}/characters/${charId}`);
+                if (!res.ok) res = await fetch(`${apiUrl}/characters/?view=summary&limit=1`);
                 const data = await res.json();
-                const current = data.find((c: any) => c.id.toString() === charId) || data[0];
+                const current = Array.isArray(data) ? data[0] : data;
                 setCharacter(current);
                 setMessages([{ id: "init", role: "assistant", content: `Hello! I am ${current.name}. ${current.description.split('.')[0]}.` }]);
             } catch (e) {
@@ -26,7 +26,7 @@ export default function Home() {
     const fetchChars = async () => {
       try {
         const apiUrl = process.env.NEXT_PUBLIC_API_URL || "http://localhost:8000";
-        const res = await fetch(`${apiUrl}/characters/`);
+        const res = await fetch(`${apiUrl}/characters/?view=summary&limit=100`);
         const data = await res.json();
         setCharacters(data);
       } catch (e) {